@@ -3,4 +3,5 @@ from api.groups import groups_api
 from api.assignments import assignments_api
 from api.announcements import announcements_api
 from api.testsuite import testsuites_api
-from api.submission import submission_api
\ No newline at end of file
+from api.submission import submission_api
+from api.judge import judge_api
\ No newline at end of file
@@ -1,20 +1,21 @@
-import json, shutil, os, zipfile
+import json, io, os
 from flask import Blueprint, request
 from db.models import *
-from tools.sandbox import Sandbox
+from tools.queue import JudgeQueue
+from tools.memo import ResultMemo
+from tools import rejudge
 from tools.tools import *
 from tools.http import HttpResponse
 from werkzeug.utils import secure_filename
 from authentication.authenticator import auth_required, group_access_level
 from minio import Minio
-from pymongo.errors import DocumentTooLarge
 
 http = HttpResponse()
-sandbox = Sandbox()
+queue = JudgeQueue()
+memo = ResultMemo()
 assignments_api = Blueprint('assignments_api', __name__)
 
 config = read_config('config.yaml')
-tmp_code_dir = config['dirs']['tmp_code_dir']
 minioconf = config["minio"]
 
 minio_key = os.environ.get("MINIO_ACCESS_KEY") or minioconf["key"]
@@ -281,32 +282,35 @@ def submit(**kwargs):
     username = kwargs.get('username')
     groupId = kwargs.get('groupId')
     assignmentId = kwargs.get('assignmentId')
-    testsuiteId = request.form.get('testsuite')
+    # one upload can be judged against several testsuites of the assignment
+    testsuiteIds = request.form.getlist('testsuite')
     language = request.form.get('language')
     sourcefile = request.files.get('source_file')
 
     group = Group.get(uid=groupId)
     assignment = Assignment.get(uid=assignmentId)
-    testsuite = Testsuite.get(uid=testsuiteId)
-
-    file_ref = None
+    testsuites = [Testsuite.get(uid=testsuiteId) for testsuiteId in testsuiteIds]
 
-    if testsuite.attempts > 0:
-        user_submissions =  Submission.objects(
-            username=username,
-            assignment=assignmentId,
-            testsuite=testsuiteId,    
-        ).count()
+    for testsuite in testsuites:
+        if testsuite and testsuite.attempts > 0:
+            user_submissions =  Submission.objects(
+                username=username,
+                assignment=assignmentId,
+                testsuite=testsuite.uid,
+            ).count()
 
-        if user_submissions >= testsuite.attempts:
-            return http.Forbidden()
+            if user_submissions >= testsuite.attempts:
+                return http.Forbidden()
 
     if not assignment:
         return http.BadRequest('invalid assignment id')
 
-    if not testsuite:
+    if not testsuites or not all(testsuites):
         return http.BadRequest('invalid testsuite id')
 
+    if len(testsuites) > 1 and any(testsuite not in assignment.testsuites for testsuite in testsuites):
+        return http.BadRequest('testsuite is not linked to the assignment')
+
     if assignment.deadline:
         if assignment.deadline <= int(time.time()):
             return http.Forbidden('Can\'t submit to closed assignment')
@@ -315,77 +319,108 @@ def submit(**kwargs):
         return http.BadRequest('no selected file')
 
     referenceId = generate_uuid(20)
-    
-    # create user dirs
-    userdir = os.path.join(tmp_code_dir, referenceId)
-    os.mkdir(userdir)
-
-    # write testcases
-    testpath = os.path.join(userdir, "testcases.json")
-    with open(testpath, "w") as f:
-        testcases = testsuite.to_dict()["testcases"]
-        json.dump(testcases, f)
-
-    # download test attachments
-    attachments = miniocl.list_objects("testsuites", prefix="{}/".format(testsuiteId))
-    if attachments:
-        for attachment in attachments:
-            attachment_name = attachment.object_name
-            path = os.path.join(userdir, attachment_name.split("/")[1])
-            miniocl.fget_object('testsuites', attachment_name, path)
- 
-
-    sourcefilepath = os.path.join(userdir, sourcefile.filename)
-    sourcefile.save(sourcefilepath)
-
-    if not testsuite.public:
-        object_name = os.path.join(referenceId, sourcefile.filename)
-        miniocl.fput_object("submissions", object_name, sourcefilepath)
-        file_ref = object_name
-
-    result = dict()
-    envars = {
-        "PRO_LANGUAGE":language, 
-        "SOURCE_FILE":sourcefile.filename,
-        "TEST_FILE": "testcases.json"
-    }
-    container = sandbox.create("checker", userdir, env=envars)
-    try:
-        container.start()
-        container.wait(timeout=120)
-        resultpath = os.path.join(userdir, "result.json")
-        if os.path.isfile(resultpath):
-            with open(resultpath, "r") as f:
-                result = json.load(f)
+
+    # archive the source so any judge worker can fetch it
+    source = sourcefile.read()
+    filename = secure_filename(sourcefile.filename)
+    object_name = os.path.join(referenceId, filename)
+    miniocl.put_object("submissions", object_name, io.BytesIO(source), len(source))
+
+    submissions = []
+    pending = []
+    for testsuite in testsuites:
+        # identical source against an unchanged testsuite gives the same verdict
+        judge_key = memo.key(testsuite, filename, language, source)
+        judged = memo.lookup(judge_key)
+
+        # one submission per testsuite keeps attempts and visibility per testsuite
+        submission = Submission(
+            uid=referenceId if not submissions else generate_uuid(20),
+            group=groupId,
+            assignment=assignmentId,
+            testsuite=testsuite.uid,
+            submitted_at=generate_timestamp(),
+            username=username,
+            language=language,
+            status='Pending',
+            file_ref=object_name,
+            judge_key=judge_key
+        )
+        if judged:
+            submission.result = judged.result
+            submission.status = judged.status
+            submission.deterministic = True
         else:
-            return http.InternalServerError("Can't fetch test result")
-    finally:
-        shutil.rmtree(userdir)
-        container.remove(force=True)
+            pending.append(submission)
 
-    submission = Submission(
-        uid=referenceId,
-        group=groupId,
-        assignment=assignmentId,
-        testsuite=testsuiteId,
-        submitted_at=generate_timestamp(),
-        username=username,
-        language=language,
-        result=result,
-        file_ref=file_ref
-    )
-    err = submission.check()
-    if err:
-        return http.InternalServerError(json.dumps(err))
+        err = submission.check()
+        if err:
+            return http.InternalServerError(json.dumps(err))
+        submissions.append(submission)
 
+    data = {'uid': referenceId, 'submissions': [submission.uid for submission in submissions]}
     try:
-        submission.save()
-    except DocumentTooLarge:
-        return "Can't return your result because it is too large, please make sure your code doesn't print huge amount of data in stdout", 422
-    except:
-        return http.InternalServerError()
+        for submission in submissions:
+            submission.save()
+        if not pending:
+            return http.Created(json.dumps(data))
+        # compiled once and judged against every pending testsuite in one sandbox session
+        queue.push(pending[0], siblings=pending[1:])
+    except Exception as e:
+        return http.InternalServerError(json.dumps(e.args))
+
+    return http.Accepted(json.dumps(data))
 
-    return http.Created(json.dumps({'uid':referenceId}))
+@assignments_api.route("/assignments/<assignmentId>/rejudge", methods=['POST'])
+@auth_required
+@group_access_level('admin')
+def RejudgeAssignment(** kwargs):
+    username = kwargs.get('username')
+    groupId = kwargs.get('groupId')
+    assignmentId = kwargs.get('assignmentId')
+
+    assignment = Assignment.get(uid=assignmentId)
+    if not assignment:
+        return http.NotFound('Assignment is not found')
+
+    data = request.json or {}
+    testsuiteId = data.get('testsuiteId')
+    if testsuiteId and not Testsuite.get(uid=testsuiteId):
+        return http.BadRequest("invalid testsuite id")
+    concurrency = data.get('concurrency') or config['judge']['rejudge_concurrency']
+
+    batch, err = rejudge.schedule_batch(groupId, assignmentId, username, testsuiteId, concurrency)
+    if err:
+        return http.BadRequest(json.dumps(err))
+
+    return http.Accepted(json.dumps(rejudge.progress(batch)))
+
+@assignments_api.route("/assignments/<assignmentId>/rejudge/<batchId>")
+@auth_required
+@group_access_level('admin')
+def RejudgeProgress(** kwargs):
+    assignmentId = kwargs.get('assignmentId')
+    batchId = kwargs.get('batchId')
+
+    batch = RejudgeBatch.get(uid=batchId, assignment=assignmentId)
+    if not batch:
+        return http.NotFound('Rejudge batch is not found')
+
+    return http.Ok(json.dumps(rejudge.progress(batch)))
+
+@assignments_api.route("/assignments/<assignmentId>/rejudge/<batchId>", methods=['DELETE'])
+@auth_required
+@group_access_level('admin')
+def CancelRejudge(** kwargs):
+    assignmentId = kwargs.get('assignmentId')
+    batchId = kwargs.get('batchId')
+
+    batch = RejudgeBatch.get(uid=batchId, assignment=assignmentId)
+    if not batch:
+        return http.NotFound('Rejudge batch is not found')
+
+    rejudge.cancel_batch(batch)
+    return http.NoContent()
 
 @assignments_api.route("/assignments/<assignmentId>/submissions")
 @auth_required
@@ -0,0 +1,26 @@
+import json
+from flask import Blueprint
+from db.models import JudgeWorker
+from tools.http import HttpResponse
+from tools.memo import ResultMemo
+from tools.tools import read_config, generate_timestamp
+from authentication.authenticator import auth_required
+
+config = read_config()
+http = HttpResponse()
+memo = ResultMemo()
+judge_api = Blueprint('judge_api', __name__)
+
+@judge_api.route("/judge/stats")
+@auth_required
+def GetJudgeStats(**kwargs):
+    # workers that missed a few heartbeats are gone, their jobs get requeued
+    alive = JudgeWorker.objects(heartbeat_at__gte=generate_timestamp() - config['judge']['lease'])
+    workers = [worker.to_dict() for worker in alive]
+    data = {
+        'memo': memo.stats(),
+        'workers': workers,
+        'capacity': sum(worker['capacity'] for worker in workers),
+        'running': sum(worker['running'] for worker in workers)
+    }
+    return http.Ok(json.dumps(data))
@@ -2,12 +2,15 @@ import json, os
 from flask import Blueprint
 from tools.tools import read_config
 from tools.http import HttpResponse
-from db.models import Submission, GroupMembership
+from db.models import Submission, GroupMembership, JudgeJob
+from tools.queue import JudgeQueue
 from authentication.authenticator import auth_required
 from urllib import parse
 from minio import Minio
+from mongoengine import Q
 
 http = HttpResponse()
+queue = JudgeQueue()
 submission_api = Blueprint('submission_api', __name__)
 
 config = read_config('config.yaml')
@@ -44,6 +47,43 @@ def getSubmission(**kwargs):
 
     return http.Ok(json.dumps(result))
 
+@submission_api.route("/submissions/<submissionId>/status")
+@auth_required
+def getSubmissionStatus(**kwargs):
+    username = kwargs.get('username')
+    submissionId = kwargs.get('submissionId')
+
+    submission = Submission.get(uid=submissionId)
+    if not submission:
+        return http.NotFound()
+
+    groupId = submission.group.uid
+    group_membership = GroupMembership.get(group=groupId, user=username)
+
+    if not group_membership:
+        return http.Forbidden()
+
+    if group_membership.role != 'admin' and submission.username != username:
+        return http.Forbidden()
+
+    data = {
+        'uid': submission.uid,
+        'status': submission.status,
+        'timings': submission.timings
+    }
+
+    job = JudgeJob.objects(Q(submission=submissionId) | Q(siblings=submissionId)).order_by('-created_at').first()
+    if job:
+        data.update({
+            'state': job.state,
+            'position': queue.position(job),
+            'queued_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at
+        })
+
+    return http.Ok(json.dumps(data))
+
 @submission_api.route("/submissions/<submissionId>/download")
 @auth_required
 def DownlodFile(**kwargs):
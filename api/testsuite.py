@@ -4,6 +4,7 @@ from db.models import *
 from urllib import parse
 from tools.tools import *
 from tools.http import HttpResponse
+from tools import rejudge
 from authentication.authenticator import auth_required, group_access_level
 from minio import Minio
 
@@ -32,13 +33,13 @@ def ListTestsuites(** kwargs):
         requested_testsuites = Testsuite.objects(
             group=groupId, 
             public=True
-        ).exclude('testcases').limit(limit).skip(offset)
+        ).limit(limit).skip(offset)
 
     elif user_role == 'admin':
         count = Testsuite.objects(group=groupId).count()
         requested_testsuites = Testsuite.objects(
             group=groupId
-        ).exclude('testcases').limit(limit).skip(offset)
+        ).limit(limit).skip(offset)
 
     testsuites = []
     for testsuite in requested_testsuites:
@@ -57,6 +58,10 @@ def ListTestsuites(** kwargs):
 @auth_required
 @group_access_level('members')
 def GetTestsuiteInfo(** kwargs):
+    limit = request.args.get('limit', 25, int)
+    page = request.args.get('page', 1, int) or 1
+    offset = (page - 1) * limit
+
     user_role = kwargs.get('user_role')
     testsuiteId = kwargs.get('testsuiteId')
 
@@ -74,8 +79,13 @@ def GetTestsuiteInfo(** kwargs):
         name = attachment.object_name.split("/")[1]
         attachments_list.append(name)
 
+    count = testsuite.testcases.count()
+    testcases = [testcase.to_dict() for testcase in testsuite.testcases.skip(offset).limit(limit)]
+
     testsuite = testsuite.to_dict()
     testsuite["attachments"] = attachments_list
+    testsuite["testcases"] = testcases
+    testsuite["pagenation"] = pagenate(limit, page, count, request.url)
 
     return http.Ok(json.dumps(testsuite))
 
@@ -91,15 +101,23 @@ def CreateTestsuite(** kwargs):
     public = bool(request.form.get('public'))
     enable_suggestions = bool(request.form.get('enable_suggestions'))
     attempts = request.form.get('attempts') or 0
+    concurrency = request.form.get('concurrency') or 1
+    time_limit = request.form.get('time_limit') or 3
+    memory_limit = request.form.get('memory_limit') or 256
+    fail_fast = request.form.get('fail_fast') or 0
+    compiler_standard = request.form.get('compiler_standard') or 'c++17'
+    compiler_optimization = request.form.get('compiler_optimization') or 'O2'
     file = request.files.get('file', None)
     attachments = request.files.getlist('attachments', None)
 
     timestamp = generate_timestamp()
 
+    testcases = []
     if file:
-        testcases = parse_testcases_file(file, username, timestamp)
-    else:
-        testcases = []
+        try:
+            testcases = parse_testcases_file(file.stream, username, timestamp, file.filename)
+        except ValueError as e:
+            return http.BadRequest(str(e))
 
     uid = generate_uuid()
 
@@ -118,8 +136,14 @@ def CreateTestsuite(** kwargs):
         public=public,
         enable_suggestions=enable_suggestions,
         attempts=attempts,
+        concurrency=concurrency,
+        time_limit=time_limit,
+        memory_limit=memory_limit,
+        fail_fast=fail_fast,
+        compiler_standard=compiler_standard,
+        compiler_optimization=compiler_optimization,
         group=groupId,
-        testcases=testcases,
+        next_order=len(testcases),
         created_at=timestamp,
         created_by=username
     )
@@ -128,6 +152,11 @@ def CreateTestsuite(** kwargs):
     if err:
         return http.BadRequest(json.dumps(err))
 
+    try:
+        Testcase.add_all(uid, testcases, start=0)
+    except ValidationError as e:
+        return http.BadRequest(json.dumps(e.to_dict()))
+
     testsuite.save()
 
     data = {'uid':testsuite.uid}
@@ -149,11 +178,48 @@ def UpdateTestsuite(** kwargs):
     public = bool(request.form.get('public'))
     enable_suggestions =  bool(request.form.get('enable_suggestions'))
     attempts = request.form.get('attempts', 0)
+    concurrency = request.form.get('concurrency') or testsuite.concurrency
+    time_limit = request.form.get('time_limit') or testsuite.time_limit
+    memory_limit = request.form.get('memory_limit') or testsuite.memory_limit
+    fail_fast = request.form.get('fail_fast', testsuite.fail_fast) or 0
+    compiler_standard = request.form.get('compiler_standard') or testsuite.compiler_standard
+    compiler_optimization = request.form.get('compiler_optimization') or testsuite.compiler_optimization
+    file = request.files.get('file', None)
     attachments = request.files.getlist('attachments', None)
 
-    if int(attempts) and int(attempts) < testsuite.attempts:
+    settings = dict(
+        name=name,
+        level=level,
+        public=public,
+        enable_suggestions=enable_suggestions,
+        attempts=attempts,
+        concurrency=concurrency,
+        time_limit=time_limit,
+        memory_limit=memory_limit,
+        fail_fast=fail_fast,
+        compiler_standard=compiler_standard,
+        compiler_optimization=compiler_optimization
+    )
+    previous_attempts = testsuite.attempts
+    # update() skips conversion and validation, both are done on the loaded document first
+    for key, value in settings.items():
+        settings[key] = Testsuite._fields[key].to_python(value)
+        setattr(testsuite, key, settings[key])
+    err = testsuite.check()
+    if err:
+        return http.BadRequest(json.dumps(err))
+
+    if settings['attempts'] and settings['attempts'] < previous_attempts:
         return http.BadRequest('new attempts value must be higher than the old value')
 
+    # appended before the settings update so its revision bump covers them
+    testcases = []
+    if file:
+        try:
+            testcases = parse_testcases_file(file.stream, username, generate_timestamp(), file.filename)
+        except ValueError as e:
+            return http.BadRequest(str(e))
+
     attachments_list = []
     if attachments:
         for attachment in attachments:
@@ -163,18 +229,19 @@ def UpdateTestsuite(** kwargs):
             miniocl.put_object("testsuites", path, attachment.stream, length)
     try:
         user = User.get(username=username)
+        Testcase.add_all(testsuiteId, testcases)
         Testsuite.get(uid=testsuiteId).update(
-            name=name, 
-            level=level,
-            public=public,
-            enable_suggestions=enable_suggestions,
-            attempts=attempts,
+            inc__revision=1,
             updated_at=generate_timestamp(),
-            updated_by=user
+            updated_by=user,
+            **settings
         )
     except Exception as e:
         return http.InternalServerError(json.dumps(e.args))
 
+    if testcases:
+        rejudge.schedule(Testsuite.get(uid=testsuiteId), username)
+
     return http.NoContent()
 
 @testsuites_api.route("/testsuites/<testsuiteId>", methods=['DELETE'])
@@ -202,6 +269,7 @@ def DeleteTestsuite(** kwargs):
 @auth_required
 @group_access_level('admin')
 def DeleteTestcase(** kwargs):
+    username = kwargs.get('username')
     testsuiteId = kwargs.get('testsuiteId')
     testcasesId = kwargs.get('testcasesId')
     testsuite = Testsuite.get(uid=testsuiteId)
@@ -209,16 +277,59 @@ def DeleteTestcase(** kwargs):
     if not testsuite:
         return http.NotFound('testsuite is not found')
 
-    for i, testcase in enumerate(testsuite.testcases):
-        if str(testcase.uid) == testcasesId:
-            testsuite.testcases.pop(i)
-            testsuite.save()
-            break
-    else:
+    if not Testcase.delete(testsuite=testsuiteId, uid=testcasesId):
         return http.NotFound('testcase not found')
 
+    testsuite.update(inc__revision=1)
+    rejudge.schedule(testsuite, username)
+
     return http.NoContent()
 
+@testsuites_api.route("/testsuites/<testsuiteId>/testcases/bulk", methods=['POST'])
+@auth_required
+@group_access_level('admin')
+def BulkUpdateTestcases(** kwargs):
+    username = kwargs.get('username')
+    testsuiteId = kwargs.get('testsuiteId')
+    add = request.json.get('add') or []
+    delete = request.json.get('delete') or []
+
+    testsuite = Testsuite.get(uid=testsuiteId)
+    if not testsuite:
+        return http.NotFound('testsuite is not found')
+
+    if not (isinstance(add, list) and isinstance(delete, list)):
+        return http.BadRequest('add and delete must be lists')
+
+    timestamp = generate_timestamp()
+    testcases = []
+    for testcase in add:
+        # validated up front so a bad testcase doesn't leave the deletions applied
+        if not (isinstance(testcase, dict) and isinstance(testcase.get('stdin'), str) and isinstance(testcase.get('expected_stdout'), str)):
+            return http.BadRequest('testcases must be objects with stdin and expected_stdout')
+        testcases.append({
+            'uid': generate_uuid(10),
+            'stdin': testcase.get('stdin'),
+            'expected_stdout': testcase.get('expected_stdout'),
+            'added_by': username,
+            'added_at': timestamp
+        })
+
+    # inserted first, a failed insert is rolled back and leaves the deletions unapplied
+    try:
+        Testcase.add_all(testsuiteId, testcases, start=Testsuite.allocate(testsuiteId, len(testcases)))
+    except ValidationError as e:
+        return http.BadRequest(json.dumps(e.to_dict()))
+    deleted = Testcase.objects(testsuite=testsuiteId, uid__in=[str(uid) for uid in delete]).delete() if delete else 0
+
+    # one revision bump once both halves are written
+    if deleted or testcases:
+        testsuite.update(inc__revision=1)
+        rejudge.schedule(testsuite, username)
+
+    data = {'added': [testcase['uid'] for testcase in testcases], 'deleted': deleted}
+    return http.Ok(json.dumps(data))
+
 @testsuites_api.route("/testsuites/<testsuiteId>/testcases/suggested", methods=['GET'])
 @auth_required
 @group_access_level('member')
@@ -274,12 +385,14 @@ def AddTestcase(** kwargs):
     if not testsuite:
         return http.NotFound('testsuite is not found')
 
-    uid = generate_uuid(5)
+    uid = generate_uuid(10)
     timestamp = generate_timestamp()
 
     if user_role == 'admin':
         testcase = Testcase(
             uid=uid,
+            testsuite=testsuiteId,
+            order=0,
             stdin=stdin,
             expected_stdout=expected_stdout,
             added_by=username,
@@ -287,14 +400,14 @@ def AddTestcase(** kwargs):
             suggested_by=None
         )
 
-        testsuite.testcases.append(testcase)
-
-        err = testsuite.check()
+        err = testcase.check()
         if err:
             return http.BadRequest(json.dumps(err))
 
-        testsuite.save()
-
+        testcase.order = Testsuite.allocate(testsuiteId, 1)
+        testcase.save()
+        testsuite.update(inc__revision=1)
+        rejudge.schedule(testsuite, username)
 
     elif user_role == 'member':
         
@@ -344,6 +457,8 @@ def AcceptSuggestedTestcase(** kwargs):
 
     testcase = Testcase(
         uid=suggested_testcase.uid,
+        testsuite=testsuiteId,
+        order=Testsuite.allocate(testsuiteId, 1),
         stdin=suggested_testcase.stdin,
         expected_stdout=suggested_testcase.expected_stdout,
         added_by=username,
@@ -352,8 +467,9 @@ def AcceptSuggestedTestcase(** kwargs):
         suggested_at=suggested_testcase.suggested_at
     )
 
-    testsuite.testcases.append(testcase)
-    testsuite.save()
+    testcase.save()
+    testsuite.update(inc__revision=1)
+    rejudge.schedule(testsuite, username)
 
     SuggestedTestcase.delete(uid=testcaseId)
 
@@ -398,6 +514,7 @@ def DeleteAttachment(** kwargs):
 
     object_name = "{}/{}".format(testsuiteId, attachmentId)
     miniocl.remove_object("testsuites", object_name)
+    testsuite.update(inc__revision=1)
     return http.NoContent()
 
 
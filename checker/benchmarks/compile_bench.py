@@ -0,0 +1,57 @@
+"""Compile time of the C++ template with and without the precompiled header.
+
+Run it inside the checker image so the toolchain and /root/pch match production:
+
+    docker run --rm -v $PWD/checker/benchmarks:/bench checker python3 /bench/compile_bench.py
+"""
+import argparse, os, statistics, subprocess, sys, tempfile, time
+from importlib.machinery import SourceFileLoader
+from os import path
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+TEMPLATE = path.join(BASE_DIR, "..", "checker", "templates", "cpp")
+if not path.isfile(TEMPLATE):
+    # inside the checker image
+    TEMPLATE = "/root/checker/templates/cpp"
+
+
+def load_template(standard, optimization, pchdir=None):
+    sys.path.insert(0, path.dirname(path.dirname(TEMPLATE)))
+    module = SourceFileLoader("cpp", TEMPLATE).load_module()
+    module.pchdir = pchdir or module.pchdir
+    module.standard = standard
+    module.optimization = optimization
+    return module
+
+
+def measure(flags, sourcefile, runs):
+    timings = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(runs):
+            start = time.monotonic()
+            subprocess.run(["g++"] + flags + [sourcefile, "-o", path.join(workdir, "output.out")], check=True)
+            timings.append(time.monotonic() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--standard", default="c++17")
+    parser.add_argument("--optimization", default="O2")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--pchdir", help="precompiled headers, defaults to the template's")
+    parser.add_argument("--corpus", default=path.join(BASE_DIR, "corpus"))
+    args = parser.parse_args()
+
+    template = load_template(args.standard, args.optimization, args.pchdir)
+    tuned = template.compile_flags()
+    plain = [flag for flag in tuned if not flag.startswith("-I")]
+    if tuned == plain:
+        print("no precompiled header for {}-{}, both columns use the same flags".format(args.standard, args.optimization))
+
+    print("{:<16}{:>10}{:>10}{:>10}".format("source", "plain", "pch", "speedup"))
+    for name in sorted(os.listdir(args.corpus)):
+        sourcefile = path.join(args.corpus, name)
+        before = measure(plain, sourcefile, args.runs)
+        after = measure(tuned, sourcefile, args.runs)
+        print("{:<16}{:>9.2f}s{:>9.2f}s{:>9.1f}x".format(name, before, after, before / after))
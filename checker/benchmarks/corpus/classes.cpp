@@ -0,0 +1,46 @@
+#include <iostream>
+#include <vector>
+#include <string>
+#include <memory>
+
+class Shape {
+public:
+    virtual ~Shape() = default;
+    virtual double area() const = 0;
+    virtual std::string name() const = 0;
+};
+
+class Rectangle : public Shape {
+    double w, h;
+public:
+    Rectangle(double w, double h) : w(w), h(h) {}
+    double area() const override { return w * h; }
+    std::string name() const override { return "rectangle"; }
+};
+
+class Circle : public Shape {
+    double r;
+public:
+    explicit Circle(double r) : r(r) {}
+    double area() const override { return 3.14159265358979 * r * r; }
+    std::string name() const override { return "circle"; }
+};
+
+int main() {
+    std::vector<std::unique_ptr<Shape>> shapes;
+    std::string kind;
+    while (std::cin >> kind) {
+        if (kind == "r") {
+            double w, h;
+            std::cin >> w >> h;
+            shapes.push_back(std::make_unique<Rectangle>(w, h));
+        } else {
+            double r;
+            std::cin >> r;
+            shapes.push_back(std::make_unique<Circle>(r));
+        }
+    }
+    for (auto &shape : shapes)
+        std::cout << shape->name() << " " << shape->area() << "\n";
+    return 0;
+}
@@ -0,0 +1,17 @@
+#include <bits/stdc++.h>
+using namespace std;
+
+int main() {
+    map<string, int> words;
+    string word;
+    while (cin >> word) {
+        transform(word.begin(), word.end(), word.begin(), ::tolower);
+        words[word]++;
+    }
+    vector<pair<int, string>> ranked;
+    for (auto &entry : words) ranked.push_back({-entry.second, entry.first});
+    sort(ranked.begin(), ranked.end());
+    for (size_t i = 0; i < min<size_t>(10, ranked.size()); i++)
+        cout << ranked[i].second << " " << -ranked[i].first << "\n";
+    return 0;
+}
@@ -0,0 +1,10 @@
+#include <bits/stdc++.h>
+using namespace std;
+
+int main() {
+    long long n, x, total = 0;
+    cin >> n;
+    while (n-- && cin >> x) total += x;
+    cout << total << endl;
+    return 0;
+}
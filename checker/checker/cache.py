@@ -0,0 +1,81 @@
+import hashlib, os, shutil, tempfile
+from os import path
+
+class CompileCache:
+    """Content addressed store of compiled artifacts with LRU eviction by total size."""
+
+    def __init__(self, cachedir, max_size):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, workdir, sourcefiles, language, flags, toolchain):
+        digest = hashlib.sha256()
+        for item in (language, " ".join(flags), toolchain):
+            digest.update(item.encode("utf-8") + b"\0")
+
+        for sourcefile in sorted(sourcefiles):
+            filepath = path.join(workdir, sourcefile)
+            if not path.isfile(filepath):
+                continue
+            digest.update(sourcefile.encode("utf-8") + b"\0")
+            with open(filepath, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def fetch(self, key, workdir, artifacts):
+        entry = path.join(self.cachedir, key)
+        try:
+            for artifact in artifacts:
+                shutil.copy2(path.join(entry, artifact), path.join(workdir, artifact))
+            # mark entry as recently used
+            os.utime(entry)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, workdir, artifacts):
+        entry = path.join(self.cachedir, key)
+        if path.isdir(entry):
+            return
+
+        tmpdir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cachedir)
+        try:
+            for artifact in artifacts:
+                shutil.copy2(path.join(workdir, artifact), path.join(tmpdir, artifact))
+            os.chmod(tmpdir, 0o755)
+            os.rename(tmpdir, entry)
+        except OSError:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def _entry_size(self, entry):
+        size = 0
+        for name in os.listdir(entry):
+            size += path.getsize(path.join(entry, name))
+        return size
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            # skip entries that are still being written
+            if name.startswith(".tmp-"):
+                continue
+            entry = path.join(self.cachedir, name)
+            try:
+                size = self._entry_size(entry)
+                entries.append((path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+
+        # drop least recently used entries first
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -1,23 +1,55 @@
 import json, zipfile, argparse
 from importlib.machinery import SourceFileLoader
 from os import path, environ, listdir
-from judger import Judger
+from judger import Judger, ResultStream
+from cache import CompileCache
+from executer import OUTPUT_LIMIT, MISMATCH_PREFIX
+import transfer
+
+COMPILE_TIMEOUT = 30
 
 class Checker:
-    def __init__(self, workdir, language, sourcefile, testfile):
+    def __init__(self, workdir, language, sourcefile, testfile, concurrency=1, cache=None, user=None,
+                 output_limit=OUTPUT_LIMIT, mismatch_prefix=MISMATCH_PREFIX, time_limit=3, memory_limit=None,
+                 fail_fast=0, profile=None, only=None, compile_only=False):
         self._path = path.dirname(path.abspath(__file__))
         self.workdir = workdir
         self.language = language
         self.sourcefile = sourcefile
         self.testfile = testfile
         self.tmpltdir = path.join(self._path, "templates") 
-        self.judger = Judger()
+        # finished testcases are appended as they complete, see Judge._partial on the server
+        results = ResultStream(path.join(workdir, "result.jsonl"))
+        self.judger = Judger(workdir=workdir, concurrency=concurrency, fail_fast=fail_fast, results=results)
+        self.cache = cache
+        self.user = user
+        self.output_limit = output_limit
+        self.mismatch_prefix = mismatch_prefix
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.profile = profile or {}
+        # uids of the testcases to run, all of them when empty
+        self.only = set(only) if only else None
+        # fill the compile cache for shards that run the tests elsewhere
+        self.compile_only = compile_only
 
-    @property
-    def testcases(self):
+    def _read_testcases(self):
         testpath = path.join(self.workdir, self.testfile)
         with open(testpath, "r") as f:
-            return json.load(f)
+            if not self.testfile.endswith(".jsonl"):
+                yield from json.load(f)
+                return
+            # one testcase per line, large suites are never parsed as a whole
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @property
+    def testcases(self):
+        testcases = self._read_testcases()
+        if self.only:
+            testcases = (testcase for testcase in testcases if testcase["uid"] in self.only)
+        return testcases
 
     @property
     def languages(self):
@@ -28,8 +60,44 @@ class Checker:
         loader = SourceFileLoader(self.language, tmpltpath)
         module = loader.load_module()
         module.workdir = self.workdir
+        module.user = self.user
+        module.output_limit = self.output_limit
+        module.mismatch_prefix = self.mismatch_prefix
+        module.memory_limit = self.memory_limit
+        # compiler profile, e.g. standard and optimization level
+        for key, value in self.profile.items():
+            if value:
+                setattr(module, key, value)
         return module
 
+    def _compile(self, module, timeout):
+        sourcefiles = self.sourcefile if isinstance(self.sourcefile, list) else [self.sourcefile]
+        key = self.cache.key(self.workdir, sourcefiles, self.language, module.compile_flags(), module.toolchain())
+        if self.cache.fetch(key, self.workdir, module.artifacts):
+            self.judger.set_compiler({"returncode": 0, "error": "", "cached": True})
+            return True
+
+        # store before any submitted code runs so it can't tamper with the artifacts
+        if self.judger.compile(module, self.sourcefile, timeout=timeout):
+            self.cache.store(key, self.workdir, module.artifacts)
+            return True
+        return False
+
+    def _clashes(self, names):
+        """Archive members that would land on files already in the workdir.
+
+        The testcases and attachments may be links into a cache shared by
+        other jobs, extracting over them would change those jobs' files too.
+        """
+        existing = set(listdir(self.workdir))
+        clashes = []
+        for name in names:
+            # same normalization zipfile applies before extracting
+            parts = [part for part in name.split("/") if part not in ("", ".", "..")]
+            if parts and parts[0] in existing:
+                clashes.append(name)
+        return clashes
+
     def check(self):
         if self.language not in self.languages:
             raise ValueError("Language %s is not supported" % self.language)
@@ -38,23 +106,75 @@ class Checker:
         codepath = path.join(self.workdir, self.sourcefile)
         if zipfile.is_zipfile(codepath):
             with zipfile.ZipFile(codepath, "r") as zpf:
+                clashes = self._clashes(zpf.namelist())
+                if clashes:
+                    self.judger.set_compiler({"returncode": 1, "error": "Archive overwrites judge files: " + ", ".join(clashes)})
+                    self.judger.result["summary"]["status"] = "Compiler Error"
+                    return self.judger.result
                 zpf.extractall(self.workdir)
             self.sourcefile = zpf.namelist()
 
-        self.judger.judge(module, self.sourcefile, self.testcases, timeout=3)
+        compiled = False
+        if self.cache and hasattr(module, "compile"):
+            compiled = self._compile(module, timeout=COMPILE_TIMEOUT)
+            if not compiled:
+                return self.judger.result
+
+        if self.compile_only:
+            if hasattr(module, "compile") and not compiled and not self.judger.compile(module, self.sourcefile, timeout=COMPILE_TIMEOUT):
+                return self.judger.result
+            self.judger.result["summary"]["status"] = "Compiled"
+            return self.judger.result
+
+        self.judger.judge(
+            module, self.sourcefile, self.testcases,
+            timeout=self.time_limit, compiled=compiled, compile_timeout=COMPILE_TIMEOUT
+        )
         return self.judger.result
 
     def _export_result(self, results):
         with open(path.join(self.workdir, "result.json"), "w") as f:
             json.dump(results, f)
         
+def read_uids(filepath):
+    with open(filepath, "r") as f:
+        return {line.strip() for line in f if line.strip()}
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-w", "--workdir", type=str, default=environ.get("WORK_DIR", "/data"), help="working directory")
     parser.add_argument("-l", "--language", type=str, default=environ.get("PRO_LANGUAGE"), help="test file")
     parser.add_argument("-s", "--sourcefile", type=str, default=environ.get("SOURCE_FILE"), help="source code file")
     parser.add_argument("-t", "--testfile", type=str, default=environ.get("TEST_FILE"), help="test file")
+    parser.add_argument("-c", "--concurrency", type=int, default=environ.get("CONCURRENCY", 1), help="parallel testcases")
+    parser.add_argument("--cache", type=str, default=environ.get("COMPILE_CACHE"), help="compile cache directory")
+    parser.add_argument("--cache-size", type=int, default=environ.get("COMPILE_CACHE_SIZE", 1 << 30), help="compile cache size in bytes")
+    parser.add_argument("-u", "--user", type=str, default=environ.get("RUN_AS"), help="user to run tests as")
+    parser.add_argument("--output-limit", type=int, default=environ.get("OUTPUT_LIMIT", OUTPUT_LIMIT), help="max stdout bytes per test")
+    parser.add_argument("--mismatch-prefix", type=int, default=environ.get("MISMATCH_PREFIX", MISMATCH_PREFIX), help="bytes kept after output diverges")
+    parser.add_argument("--time-limit", type=float, default=environ.get("TIME_LIMIT", 3), help="seconds per test")
+    parser.add_argument("--memory-limit", type=int, default=environ.get("MEMORY_LIMIT"), help="bytes per test")
+    parser.add_argument("--fail-fast", type=int, default=environ.get("FAIL_FAST", 0), help="stop after this many failed tests")
+    parser.add_argument("--standard", type=str, default=environ.get("COMPILER_STD"), help="language standard")
+    parser.add_argument("--optimization", type=str, default=environ.get("COMPILER_OPT"), help="optimization level")
+    parser.add_argument("--compile-only", action="store_true", default=bool(environ.get("COMPILE_ONLY")), help="compile without running tests")
+    parser.add_argument("--only", type=str, default=environ.get("ONLY_FILE"), help="file in the workdir listing the testcase uids to run, one per line")
+    # popped so tested programs don't inherit the presigned urls
+    parser.add_argument("--manifest", type=str, default=environ.pop("JOB_MANIFEST", None), help="presigned urls of the job files")
     args = parser.parse_args()
-    checker =  Checker(args.workdir, args.language, args.sourcefile, args.testfile)
+    manifest = json.loads(args.manifest) if args.manifest else None
+    if manifest:
+        transfer.fetch(manifest, args.workdir)
+    cache = CompileCache(args.cache, args.cache_size) if args.cache else None
+    checker =  Checker(
+        args.workdir, args.language, args.sourcefile, args.testfile, args.concurrency, cache, args.user,
+        args.output_limit, args.mismatch_prefix, args.time_limit, args.memory_limit, args.fail_fast,
+        {"standard": args.standard, "optimization": args.optimization},
+        read_uids(path.join(args.workdir, args.only)) if args.only else None,
+        args.compile_only
+    )
     results = checker.check()
-    checker._export_result(results)
\ No newline at end of file
+    if manifest:
+        transfer.upload(manifest["result"], json.dumps(results).encode("utf-8"))
+    else:
+        checker._export_result(results)
\ No newline at end of file
@@ -136,7 +136,21 @@ exitcodes = {
 		"descr": "Asynchronous I/O"
 	},
 	124: {
-		"name": "TIMEOUT",
-		"descr": "Timeout"
+		"name": "TLE",
+		"descr": "Time Limit Exceeded"
+	},
+	125: {
+		"name": "OLE",
+		"descr": "Output Limit Exceeded"
+	},
+	126: {
+		"name": "MLE",
+		"descr": "Memory Limit Exceeded"
 	}
+}
+
+verdicts = {
+	"TLE": 124,
+	"OLE": 125,
+	"MLE": 126
 }
\ No newline at end of file
@@ -1,5 +1,13 @@
-from subprocess import run, PIPE, TimeoutExpired, CompletedProcess
-from codes import exitcodes
+import codecs, os, selectors, shutil, signal, time
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired, CompletedProcess
+from codes import exitcodes, verdicts
+from limits import Cgroup, CGROUP_PARENT, prlimit_prefix, allocation_failed
+
+OUTPUT_LIMIT = 8 << 20
+STDERR_LIMIT = 64 << 10
+MISMATCH_PREFIX = 1 << 10
+# built from launcher.c with the checker image, outside /root so tests running as nobody can exec it
+LAUNCHER = shutil.which("judge-launcher")
 
 def _error_decode(response):
     stderr = ""
@@ -12,31 +20,285 @@ def _error_decode(response):
             errmsg = response.stderr
         stderr = "Exit code ({}): {}".format(abs(response.returncode), errmsg)
     return response.returncode, stderr
-        
-def execute(cmd, workdir=None, timeout=60):
-    cmd = ["/bin/bash", "-c", cmd]
+
+
+class OutputMatcher:
+    """Compares streamed output with the expected one, ignoring surrounding whitespace."""
+
+    def __init__(self, expected):
+        self.expected = expected.strip()
+        self.position = 0
+        self.started = False
+        self.diverged = False
+
+    def feed(self, text):
+        if self.diverged:
+            return
+
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+
+        head = text[:len(self.expected) - self.position]
+        if head != self.expected[self.position:self.position + len(head)]:
+            self.diverged = True
+            return
+        self.position += len(head)
+
+        # only trailing whitespace may follow the expected output
+        if text[len(head):].strip():
+            self.diverged = True
+
+
+def _program_path(program, workdir=None):
+    """Resolved path of the binary program runs, what /proc/<pid>/exe points to once it started."""
+    if "/" not in program:
+        program = shutil.which(program)
+        if not program:
+            return None
+    return os.path.realpath(os.path.join(workdir or os.getcwd(), program))
+
+
+def _program_pid(process):
+    """Pid of the tested program, the launcher's only child when it runs under one."""
+    if not process.launched:
+        return process.pid
+    if not process.program_pid:
+        try:
+            with open("/proc/{0}/task/{0}/children".format(process.pid)) as f:
+                children = f.read().split()
+        except OSError:
+            return None
+        process.program_pid = int(children[0]) if children else None
+    return process.program_pid
+
+
+def _peak_rss(pid, program):
+    """Peak resident set size (KB) of the running process image.
+
+    0 until pid runs program, before that VmHWM belongs to the forked checker
+    or prlimit, and right at exec to an image that hasn't been loaded yet.
+    """
+    try:
+        if os.readlink("/proc/{}/exe".format(pid)) != program:
+            return 0
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class MemoryLimitExceeded(Exception):
+    pass
+
+
+def _sample_rss(process, memory_limit=None):
+    pid = _program_pid(process)
+    if pid:
+        process.peak_rss = max(process.peak_rss, _peak_rss(pid, process.program))
+    if memory_limit and process.peak_rss * 1024 > memory_limit:
+        raise MemoryLimitExceeded()
+
+
+def _wait(process, timeout=None, memory_limit=None):
+    """Reap the process with wait4 to collect its resource usage."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        options = 0 if deadline is None else os.WNOHANG
+        pid, status, rusage = os.wait4(process.pid, options)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        _sample_rss(process, memory_limit)
+        if time.monotonic() >= deadline:
+            raise TimeoutExpired(process.args, timeout)
+        time.sleep(0.005)
+
+
+def execute(cmd, workdir=None, timeout=60, user=None, stdin=None, expected=None,
+            output_limit=OUTPUT_LIMIT, mismatch_prefix=MISMATCH_PREFIX, memory_limit=None):
+    """Run cmd (argv list) without a shell, stdin is an open file streamed to the process.
+
+    Output is read incrementally and bounded by output_limit. When expected is given the
+    process is killed once its output diverged by more than mismatch_prefix bytes.
+    memory_limit (bytes) is enforced by a cgroup v2 scope when the checker can create
+    one, by rlimits and RSS sampling otherwise.
+    """
+    cgroup = None
+    program = _program_path(cmd[0], workdir)
+    if memory_limit:
+        cmd = prlimit_prefix(timeout, memory_limit) + cmd
+        if CGROUP_PARENT:
+            cgroup = Cgroup(memory_limit)
+
+    # ru_maxrss of a child forked from the checker counts the checker memory it
+    # started with, the launcher forks the program from a small process instead
+    launched = LAUNCHER is not None
+    ready = report = (None, None)
+    if launched:
+        ready, report = os.pipe(), os.pipe()
+        cmd = [LAUNCHER, str(ready[0]), str(report[1])] + cmd
+
+    started = time.monotonic()
     try:
-        response = run(
+        process = Popen(
             cmd,
+            stdin=stdin or DEVNULL,
             stderr=PIPE,
             stdout=PIPE,
             cwd=workdir,
-            timeout=timeout,
-            universal_newlines=True,
-        )
-    except TimeoutExpired:
-        response = CompletedProcess(
-            args=cmd,
-            returncode=124,
-            stderr="Timeout"
+            user=user,
+            pass_fds=(ready[0], report[1]) if launched else (),
         )
     except:
+        for fd in ready + report:
+            if fd is not None:
+                os.close(fd)
         response = CompletedProcess(
             args=cmd,
             returncode=-1,
+            stdout="",
             stderr="Internal Checker Error"
         )
+        response.returncode, response.stderr = _error_decode(response)
+        response.verdict, response.mismatch, response.usage = None, False, None
+        if cgroup:
+            cgroup.remove()
+        return response
+
+    if cgroup:
+        cgroup.add(process.pid)
+    if launched:
+        # the launcher forks the program once it is in the cgroup
+        os.close(ready[0])
+        os.close(report[1])
+        os.write(ready[1], b"\0")
+        os.close(ready[1])
+
+    # without the launcher ru_maxrss is inflated, the peak of the program image
+    # is sampled from /proc while it runs
+    process.launched = launched
+    process.program = program
+    process.program_pid = None
+    process.peak_rss = 0
+    stdout, stderr = bytearray(), bytearray()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    matcher = OutputMatcher(expected) if expected is not None else None
+    diverged_at = None
+    verdict = None
+    mismatch = False
+
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ)
+    selector.register(process.stderr, selectors.EVENT_READ)
+    deadline = time.monotonic() + timeout
+
+    with selector:
+        while selector.get_map() and not (verdict or mismatch):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                verdict = "TLE"
+                break
+
+            try:
+                _sample_rss(process, memory_limit)
+            except MemoryLimitExceeded:
+                verdict = "MLE"
+                break
+
+            for key, _ in selector.select(min(remaining, 0.01)):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+
+                if key.fileobj is process.stderr:
+                    stderr += data[:STDERR_LIMIT - len(stderr)]
+                    continue
+
+                if len(stdout) + len(data) > output_limit:
+                    verdict = "OLE"
+                    break
+                stdout += data
+
+                if matcher:
+                    matcher.feed(decoder.decode(data))
+                    if matcher.diverged and diverged_at is None:
+                        diverged_at = len(stdout)
+                    if diverged_at is not None and len(stdout) - diverged_at >= mismatch_prefix:
+                        mismatch = True
+                        break
+
+    rusage = None
+    if not (verdict or mismatch):
+        try:
+            rusage = _wait(process, max(0, deadline - time.monotonic()), memory_limit)
+        except TimeoutExpired:
+            verdict = "TLE"
+        except MemoryLimitExceeded:
+            verdict = "MLE"
+
+    if rusage is None:
+        # killing the program rather than the launcher still gets its usage reported
+        try:
+            os.kill((launched and _program_pid(process)) or process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        rusage = _wait(process)
+    wall_time = time.monotonic() - started
+    reported_rss = 0
+    if launched:
+        # empty when the launcher was killed before the program exited
+        with os.fdopen(report[0], "rb") as f:
+            reported = f.read().strip()
+        reported_rss = int(reported) if reported.isdigit() else 0
+        if memory_limit and not verdict and reported_rss * 1024 > memory_limit:
+            # exited between two samples
+            verdict = "MLE"
+    process.stdout.close()
+    process.stderr.close()
+
+    if cgroup:
+        if cgroup.oom_killed():
+            verdict = "MLE"
+        process.peak_rss = max(process.peak_rss, cgroup.peak())
+        cgroup.remove()
+
+    if process.returncode == -signal.SIGXCPU:
+        verdict = "TLE"
+    elif not verdict and allocation_failed(memory_limit, process.returncode, stderr):
+        # refused before the memory was used, no sample or cgroup sees it
+        verdict = "MLE"
+
+    returncode = process.returncode
+    errmsg = stderr.decode("utf-8", errors="replace")
+    if verdict:
+        returncode = verdicts[verdict]
+        errmsg = exitcodes[returncode]["descr"]
+        if verdict == "TLE":
+            stdout = b""
+    elif mismatch:
+        # killed on purpose, the captured prefix is enough to report a wrong answer
+        returncode, stdout = 0, stdout[:diverged_at + mismatch_prefix]
 
-    response.stdout = "" if not response.stdout else str(response.stdout)
+    response = CompletedProcess(
+        args=cmd,
+        returncode=returncode,
+        stdout=stdout.decode("utf-8", errors="replace"),
+        stderr=errmsg
+    )
+    response.verdict = verdict
+    response.mismatch = mismatch
+    response.usage = {
+        "wall_time": round(wall_time, 3),
+        "user_time": round(rusage.ru_utime, 3),
+        "sys_time": round(rusage.ru_stime, 3),
+        "max_rss": reported_rss or process.peak_rss or rusage.ru_maxrss,
+    }
     response.returncode, response.stderr = _error_decode(response)
-    return response
\ No newline at end of file
+    return response
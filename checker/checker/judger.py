@@ -1,28 +1,85 @@
-import unittest, traceback
+import unittest, traceback, threading, tempfile, shutil, os, json
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import TimeoutExpired
 
+OUTPUT_PREVIEW = 64 << 10
+
 class TestcaseError(BaseException):
     pass
 
 
+def cpu_quota():
+    """Number of CPUs the container is allowed to use."""
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, int(quota) // int(period)))
+
+
+class ResultStream:
+    """JSON lines log of finished steps, a killed run still leaves its partial result."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        open(filepath, "w").close()
+
+    def write(self, kind, record):
+        line = json.dumps(dict(record, type=kind)) + "\n"
+        with self._lock, open(self.filepath, "a") as f:
+            f.write(line)
+
+
 class TestResult(unittest.TextTestResult):
-    def __init__(self, stream=None, descriptions=None, verbosity=0):
+    def __init__(self, stream=None, descriptions=None, verbosity=0, fail_fast=0, results=None):
         super(TestResult, self).__init__(stream, descriptions, verbosity)
+        self.results = results
         self.success_count = 0
         self.failures_count = 0
         self.errors_count = 0
+        self.skipped_count = 0
+        self.fail_fast = fail_fast
         self.result = []
 
+    def _check_fail_fast(self):
+        if self.fail_fast and self.failures_count + self.errors_count >= self.fail_fast:
+            self.stop()
+
     def addError(self, test, error):
         self.errors_count += 1
         self.saveTestCaseResult(test, "errored", error)
+        self._check_fail_fast()
         return super(TestResult, self).addError(test, error)
 
     def addFailure(self, test, error):
         self.failures_count += 1
         self.saveTestCaseResult(test, "failed", error)
+        self._check_fail_fast()
         return super(TestResult, self).addFailure(test, error)
 
+    def addSkipped(self, test):
+        self.skipped_count += 1
+        self._append({"uid": test.testcase["uid"], "status": "skipped"})
+
+    def _append(self, result):
+        self.result.append(result)
+        if self.results:
+            self.results.write("test", result)
+
     def addSuccess(self, test):
         self.success_count += 1
         self.saveTestCaseResult(test, "passed")
@@ -34,14 +91,18 @@ class TestResult(unittest.TextTestResult):
             "stdin": repr(test.testcase["stdin"]),
             "stdout": repr(test.stdout),
             "stderr": test.response.stderr,
-            "generated_stdout": repr(test.response.stdout),
+            "generated_stdout": repr(test.response.stdout[:OUTPUT_PREVIEW]),
             "status": status,
         }
+        if getattr(test.response, "usage", None):
+            result["usage"] = test.response.usage
+        if getattr(test.response, "verdict", None):
+            result["verdict"] = test.response.verdict
         if error:
             error = "".join(traceback.format_exception_only(error[0], error[1])).strip()
             result["error"] = error
 
-        self.result.append(result)
+        self._append(result)
 
 
 class TestCase(unittest.TestCase):
@@ -50,49 +111,144 @@ class TestCase(unittest.TestCase):
         self.module = module
         self.testcase = testcase
         self.timeout = timeout
+        self.workdir = None
 
     def runTest(self):
         self.stdout = str(self.testcase["expected_stdout"]).strip()
 
-        self.response = self.module.runTest(
-            stdin=self.testcase["stdin"], timeout=self.timeout
-        )
+        # the input is spooled to a file once and the kernel streams it to the program
+        with tempfile.TemporaryFile() as stdin:
+            stdin.write(self.testcase["stdin"].encode("utf-8"))
+            stdin.seek(0)
+            self.response = self.module.runTest(
+                stdin=stdin, timeout=self.timeout, cwd=self.workdir, expected=self.stdout
+            )
 
         if self.response.returncode:
             raise TestcaseError(self.response.stderr)
            
         self.generated_stdout = self.response.stdout.strip()
 
+        if self.response.mismatch:
+            raise AssertionError(
+                "{}... != {}".format(repr(self.generated_stdout), repr(self.stdout))
+            )
+
         if self.generated_stdout != self.stdout:
             raise AssertionError(
                 "{} != {}".format(repr(self.generated_stdout), repr(self.stdout))
             )
 
+def aggregate_usage(tests):
+    """Totals and peaks of the per testcase resource usage."""
+    usages = [test["usage"] for test in tests if test.get("usage")]
+    if not usages:
+        return {}
+
+    return {
+        "wall_time": round(sum(x["wall_time"] for x in usages), 3),
+        "user_time": round(sum(x["user_time"] for x in usages), 3),
+        "sys_time": round(sum(x["sys_time"] for x in usages), 3),
+        "max_wall_time": max(x["wall_time"] for x in usages),
+        "max_cpu_time": max(x["user_time"] + x["sys_time"] for x in usages),
+        "max_rss": max(x["max_rss"] for x in usages),
+    }
+
+
 class Judger:
-    def __init__(self):
-        self.testresult = TestResult()
+    def __init__(self, workdir=None, concurrency=1, fail_fast=0, results=None):
+        self.workdir = workdir
+        self.concurrency = max(1, min(concurrency, cpu_quota()))
+        self.fail_fast = fail_fast
+        self.results = results
+        self.testresult = TestResult(fail_fast=fail_fast, results=results)
         self.testsuite = unittest.TestSuite()
+        self.tests = []
+        self.result = {"tests": [], "compiler": {}, "summary": {}}
 
     def _create_testsuite(self, module, testcases, timeout):
         for testcase in testcases:
             obj = TestCase(module=module, testcase=testcase, timeout=timeout)
             self.testsuite.addTest(obj)
+            self.tests.append(obj)
 
-    def judge(self, module, sourcefile, testcases, timeout=10):
-        self.result = {"tests": [], "compiler": {}, "summary": {}}
+    def _create_scratchdir(self):
+        scratchdir = tempfile.mkdtemp(prefix="judge-")
+        os.chmod(scratchdir, 0o755)
+        for name in os.listdir(self.workdir):
+            filepath = os.path.join(self.workdir, name)
+            if os.path.isdir(filepath):
+                shutil.copytree(filepath, os.path.join(scratchdir, name))
+            else:
+                shutil.copy2(filepath, scratchdir)
+        return scratchdir
 
-        if hasattr(module, "compile"):
-            compiler = module.compile(sourcefile, timeout=timeout)
-            self.result["compiler"] = {
-                "returncode": compiler.returncode,
-                "error": compiler.stderr,
-            }
-            if compiler.returncode:
-                self.result["summary"]["status"] = "Compiler Error"
+    def _run_parallel(self):
+        local = threading.local()
+        lock = threading.Lock()
+        scratchdirs = []
+        failed = [0]
+
+        def run(test):
+            if self.fail_fast and failed[0] >= self.fail_fast:
+                return None
+
+            # every worker thread runs its testcases in a private copy of workdir
+            if not hasattr(local, "scratchdir"):
+                local.scratchdir = self._create_scratchdir()
+                scratchdirs.append(local.scratchdir)
+            test.workdir = local.scratchdir
+            result = TestResult(results=self.results)
+            test.run(result)
+            with lock:
+                failed[0] += result.failures_count + result.errors_count
+            return result
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                # map keeps the testcases order regardless of completion order
+                results = list(executor.map(run, self.tests))
+        finally:
+            for scratchdir in scratchdirs:
+                shutil.rmtree(scratchdir, ignore_errors=True)
+
+        for test, result in zip(self.tests, results):
+            if result is None:
+                self.testresult.addSkipped(test)
+                continue
+            self.testresult.success_count += result.success_count
+            self.testresult.failures_count += result.failures_count
+            self.testresult.errors_count += result.errors_count
+            self.testresult.result.extend(result.result)
+
+    def set_compiler(self, compiler):
+        self.result["compiler"] = compiler
+        if self.results:
+            self.results.write("compiler", compiler)
+
+    def compile(self, module, sourcefile, timeout=10):
+        compiler = module.compile(sourcefile, timeout=timeout)
+        self.set_compiler({
+            "returncode": compiler.returncode,
+            "error": compiler.stderr,
+        })
+        if compiler.returncode:
+            self.result["summary"]["status"] = "Compiler Error"
+        return not compiler.returncode
+
+    def judge(self, module, sourcefile, testcases, timeout=10, compiled=False, compile_timeout=None):
+        if hasattr(module, "compile") and not compiled:
+            if not self.compile(module, sourcefile, timeout=compile_timeout or timeout):
                 return
 
         self._create_testsuite(module=module, testcases=testcases, timeout=timeout)
-        self.testsuite.run(self.testresult)
+        if self.concurrency > 1 and self.workdir:
+            self._run_parallel()
+        else:
+            self.testsuite.run(self.testresult)
+            # tests left after fail fast stopped the run
+            for test in self.tests[len(self.testresult.result):]:
+                self.testresult.addSkipped(test)
 
         status = (
             "Failed"
@@ -107,7 +263,9 @@ class Judger:
                     "success": self.testresult.success_count,
                     "failures": self.testresult.failures_count,
                     "errors": self.testresult.errors_count,
+                    "skipped": self.testresult.skipped_count,
                     "status": status,
+                    "usage": aggregate_usage(self.testresult.result),
                 },
             }
         )
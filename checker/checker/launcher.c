@@ -0,0 +1,68 @@
+/*
+ * Runs a tested program and reports its peak resident set size.
+ *
+ *     launcher READY_FD REPORT_FD PROGRAM [ARGS...]
+ *
+ * A child forked from the checker starts out with the checker's memory and
+ * wait4 counts it in ru_maxrss. The program is forked from this small
+ * process instead, so its ru_maxrss is its own. The launcher waits for a byte
+ * on READY_FD, the checker sends it once the launcher is in its cgroup, then
+ * writes the peak (KB) to REPORT_FD and exits the way the program did.
+ */
+#include <errno.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include <sys/prctl.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+
+int main(int argc, char **argv) {
+    if (argc < 4)
+        return 127;
+    int ready = atoi(argv[1]);
+    int report = atoi(argv[2]);
+
+    char byte;
+    while (read(ready, &byte, 1) < 0 && errno == EINTR)
+        ;
+    close(ready);
+
+    pid_t parent = getpid();
+    pid_t pid = fork();
+    if (pid < 0)
+        return 127;
+    if (pid == 0) {
+        close(report);
+        // a launcher killed on timeout takes the program with it
+        prctl(PR_SET_PDEATHSIG, SIGKILL);
+        if (getppid() != parent)
+            _exit(127);
+        execvp(argv[3], argv + 3);
+        _exit(127);
+    }
+
+    int status;
+    struct rusage usage;
+    while (wait4(pid, &status, 0, &usage) < 0) {
+        if (errno != EINTR)
+            return 127;
+    }
+    dprintf(report, "%ld\n", usage.ru_maxrss);
+    close(report);
+
+    if (WIFSIGNALED(status)) {
+        int sig = WTERMSIG(status);
+        struct rlimit core = {0, 0};
+        sigset_t set;
+        setrlimit(RLIMIT_CORE, &core);
+        signal(sig, SIG_DFL);
+        sigemptyset(&set);
+        sigaddset(&set, sig);
+        sigprocmask(SIG_UNBLOCK, &set, NULL);
+        raise(sig);
+        return 128 + sig;
+    }
+    return WEXITSTATUS(status);
+}
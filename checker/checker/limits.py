@@ -0,0 +1,111 @@
+import math, os, uuid
+from os import path
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# what programs print when an allocation is refused, the address space limit fails them this way
+ALLOCATION_FAILURES = (b"std::bad_alloc", b"Cannot allocate memory", b"MemoryError")
+
+
+def _cgroup_parent():
+    """Writable cgroup v2 directory with the memory controller, if any."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    current = path.join(CGROUP_ROOT, line.strip()[3:].lstrip("/"))
+                    break
+            else:
+                return None
+        with open(path.join(current, "cgroup.controllers")) as f:
+            if "memory" not in f.read().split():
+                return None
+    except OSError:
+        return None
+
+    parent = path.join(current, "judge")
+    try:
+        os.makedirs(parent, exist_ok=True)
+        # processes can't live in a cgroup that delegates controllers
+        if not path.exists(path.join(parent, "init")):
+            os.mkdir(path.join(parent, "init"))
+            with open(path.join(current, "cgroup.procs")) as f:
+                pids = f.read().split()
+            for pid in pids:
+                with open(path.join(parent, "init", "cgroup.procs"), "w") as f:
+                    f.write(pid)
+        with open(path.join(current, "cgroup.subtree_control"), "w") as f:
+            f.write("+memory")
+        with open(path.join(parent, "cgroup.subtree_control"), "w") as f:
+            f.write("+memory")
+    except OSError:
+        return None
+    return parent
+
+
+CGROUP_PARENT = _cgroup_parent()
+
+
+class Cgroup:
+    """Per run cgroup v2 scope enforcing memory.max."""
+
+    def __init__(self, memory_limit):
+        self.path = path.join(CGROUP_PARENT, "run-" + uuid.uuid4().hex)
+        os.mkdir(self.path)
+        self._write("memory.max", memory_limit)
+        self._write("memory.swap.max", 0)
+
+    def _write(self, name, value):
+        try:
+            with open(path.join(self.path, name), "w") as f:
+                f.write(str(value))
+        except OSError:
+            pass
+
+    def _read(self, name):
+        try:
+            with open(path.join(self.path, name)) as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def add(self, pid):
+        self._write("cgroup.procs", pid)
+
+    def oom_killed(self):
+        for line in self._read("memory.events").splitlines():
+            key, value = line.split()
+            if key == "oom_kill":
+                return int(value) > 0
+        return False
+
+    def peak(self):
+        """Peak memory usage in KB, 0 when the kernel doesn't report it."""
+        value = self._read("memory.peak").strip()
+        return int(value) // 1024 if value.isdigit() else 0
+
+    def remove(self):
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+def prlimit_prefix(time_limit=None, memory_limit=None):
+    """prlimit(1) wrapper applying rlimits to the program before it starts."""
+    prefix = ["prlimit"]
+    if time_limit:
+        # wall clock timeout is the real limit, this stops busy loops in forked children
+        prefix.append("--cpu={}".format(math.ceil(time_limit) + 1))
+    if memory_limit and not CGROUP_PARENT:
+        # address space is larger than resident memory, leave room for mappings
+        prefix.append("--as={}".format(memory_limit * 2 + (64 << 20)))
+    if len(prefix) == 1:
+        return []
+    return prefix + ["--"]
+
+
+def allocation_failed(memory_limit, returncode, stderr):
+    """Whether a failed run hit the address space limit prlimit_prefix sets without a cgroup."""
+    if not memory_limit or CGROUP_PARENT or not returncode:
+        return False
+    return any(failure in stderr for failure in ALLOCATION_FAILURES)
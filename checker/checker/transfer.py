@@ -0,0 +1,25 @@
+import os, shutil, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+TIMEOUT = 30
+
+
+def _download(item, workdir):
+    # names come from the manifest, never let them escape workdir
+    filepath = path.join(workdir, path.basename(item["name"]))
+    with urllib.request.urlopen(item["url"], timeout=TIMEOUT) as response, open(filepath, "wb") as f:
+        shutil.copyfileobj(response, f)
+
+
+def fetch(manifest, workdir, workers=4):
+    """Downloads the job files listed in the manifest into workdir."""
+    os.makedirs(workdir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() re-raises the first failed download
+        list(executor.map(lambda item: _download(item, workdir), manifest["files"]))
+
+
+def upload(url, data):
+    request = urllib.request.Request(url, data=data, method="PUT")
+    urllib.request.urlopen(request, timeout=TIMEOUT).close()
@@ -50,4 +50,19 @@ class Assignments:
         method = 'get'
         return self.client.api_handler(url=url, method=method)
 
-        
\ No newline at end of file
+        
+    def rejudge(self, groupId, assignmentId, testsuiteId=None, concurrency=None):
+        url = self.client.api_url + '/groups/' + groupId + '/assignments/' + assignmentId + '/rejudge'
+        method = 'post'
+        data = {'testsuiteId':testsuiteId, 'concurrency':concurrency}
+        return self.client.api_handler(url=url, method=method, data=data)
+
+    def rejudgeProgress(self, groupId, assignmentId, batchId):
+        url = self.client.api_url + '/groups/' + groupId + '/assignments/' + assignmentId + '/rejudge/' + batchId
+        method = 'get'
+        return self.client.api_handler(url=url, method=method)
+
+    def cancelRejudge(self, groupId, assignmentId, batchId):
+        url = self.client.api_url + '/groups/' + groupId + '/assignments/' + assignmentId + '/rejudge/' + batchId
+        method = 'delete'
+        return self.client.api_handler(url=url, method=method)
@@ -11,3 +11,8 @@ class Submissions:
         url = self.client.api_url + '/submissions/' + submissionId
         method = 'get'
         return self.client.api_handler(url=url, method=method)
+
+    def status(self, submissionId):
+        url = self.client.api_url + '/submissions/' + submissionId + '/status'
+        method = 'get'
+        return self.client.api_handler(url=url, method=method)
@@ -7,10 +7,10 @@ class Testsuites:
         method = 'get'
         return self.client.api_handler(url=url, method=method)
 
-    def get(self, groupId, testsuiteId):
+    def get(self, groupId, testsuiteId, params=None):
         url = self.client.api_url + '/groups/' + groupId + '/testsuites/' + testsuiteId
         method = 'get'
-        return self.client.api_handler(url=url, method=method)
+        return self.client.api_handler(url=url, method=method, params=params)
 
     def getSuggestedTestcases(self, groupId, testsuiteId):
         url = self.client.api_url + '/groups/' + groupId + '/testsuites/' + testsuiteId + '/testcases/suggested'
@@ -29,6 +29,12 @@ class Testsuites:
         data = {'name':name, 'descreption':descreption, "level":level, 'testcases':testcases}
         return self.client.api_handler(url=url, method=method, data=data)
 
+    def bulkTestcases(self, groupId, testsuiteId, add=None, delete=None):
+        url = self.client.api_url + '/groups/' + groupId + '/testsuites/' + testsuiteId + '/testcases/bulk'
+        method = 'post'
+        data = {'add':add or [], 'delete':delete or []}
+        return self.client.api_handler(url=url, method=method, data=data)
+
     def delete(self, groupId, testsuiteId):
         url = self.client.api_url + '/groups/' + groupId + '/testsuites/' + testsuiteId
         method = 'delete'
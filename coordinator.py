@@ -0,0 +1,227 @@
+import asyncio, json, logging, os, shutil, socket, threading, time, traceback
+import docker
+from concurrent.futures import ThreadPoolExecutor
+from db.db import Database
+from db.models import JudgeWorker
+from tools.tools import read_config, generate_uuid, generate_timestamp
+from tools.queue import JudgeQueue
+from tools.judge import Judge, JudgeError, partial_result
+
+LABEL = "hexa-a.coordinator"
+
+class Coordinator:
+    """Supervises many judge containers from a single asyncio loop.
+
+    Every job runs in a one-shot checker container. Instead of a thread
+    blocked in container.wait per job, one thread follows the docker events
+    stream and resolves the future of the container that died. Blocking
+    database and storage calls go through a small fixed thread pool.
+    """
+
+    def __init__(self):
+        self._config = read_config()
+        judgeconf = self._config['judge']
+        # results are read back from the job directory, the containers must bind mount it
+        if judgeconf['transfer'] != 'mount':
+            raise ValueError("coordinator needs judge.transfer: mount, not {}".format(judgeconf['transfer']))
+        self._poll_interval = judgeconf['poll_interval']
+        self._timeout = judgeconf['timeout']
+        self._concurrency = judgeconf['coordinator_concurrency']
+        self._lease = judgeconf['lease']
+        self._max_attempts = judgeconf['max_attempts']
+        # connect to database
+        self._db = Database()
+        self._db.connect(** self._config['database'])
+        self.queue = JudgeQueue(worker="{}-{}".format(socket.gethostname(), os.getpid()), lease=self._lease)
+        # containers are started per job, a warm pool would only sit idle
+        self.judge = Judge(pool_size=0)
+        self._docker = docker.from_env()
+        self._executor = ThreadPoolExecutor(max_workers=judgeconf['coordinator_threads'])
+        self._id = generate_uuid(10)
+        self._pending = {}
+        self._jobs = {}
+        self._tasks = set()
+        self._loop = None
+        self._started_at = generate_timestamp()
+
+    def _blocking(self, func, *args, **kwargs):
+        return self._loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    def _finished(self, cid, exitcode):
+        future = self._pending.pop(cid, None)
+        if future and not future.done():
+            future.set_result(exitcode)
+
+    def _reconcile(self):
+        # die events sent while the stream was down are lost, ask docker directly
+        for cid in list(self._pending):
+            try:
+                state = self._docker.api.inspect_container(cid)["State"]
+            except docker.errors.NotFound:
+                self._loop.call_soon_threadsafe(self._finished, cid, -1)
+                continue
+            if not state["Running"]:
+                self._loop.call_soon_threadsafe(self._finished, cid, state["ExitCode"])
+
+    def _watch(self):
+        filters = {"type": "container", "event": "die", "label": "{}={}".format(LABEL, self._id)}
+        while True:
+            try:
+                self._reconcile()
+                for event in self._docker.events(decode=True, filters=filters):
+                    exitcode = int(event["Actor"]["Attributes"].get("exitCode", -1))
+                    self._loop.call_soon_threadsafe(self._finished, event["id"], exitcode)
+            except Exception:
+                logging.exception("docker events stream failed, reconnecting")
+                time.sleep(self._poll_interval)
+
+    def _start(self, job, timings):
+        """Stages the job files and creates its container, the container isn't started yet."""
+        submission = job.submission
+        start = time.monotonic()
+        jobdir, sourcefile = self.judge.stage(submission, timings)
+        timings["staging"] = round(time.monotonic() - start, 3)
+        try:
+            envars = self.judge.environment(submission, sourcefile)
+            command = ["timeout", str(self._timeout), "python3", "checker.py"]
+            container = self.judge.sandbox.create(
+                self.judge.sandbox.image, jobdir, env=envars, command=command, labels={LABEL: self._id}
+            )
+        except Exception:
+            shutil.rmtree(jobdir, ignore_errors=True)
+            raise
+        return submission, jobdir, container
+
+    def _collect(self, submission, jobdir, exitcode):
+        if exitcode == 124:
+            streampath = os.path.join(jobdir, "result.jsonl")
+            if not os.path.isfile(streampath):
+                raise JudgeError("Judge timed out")
+            with open(streampath, "r") as f:
+                lines = f.read().splitlines()
+            if not lines:
+                raise JudgeError("Judge timed out")
+            return partial_result(lines, submission.testsuite.testcase_uids(), "Judge timed out")
+
+        resultpath = os.path.join(jobdir, "result.json")
+        if not os.path.isfile(resultpath):
+            raise JudgeError("Can't fetch test result")
+        with open(resultpath, "r") as f:
+            return json.load(f)
+
+    def _finish(self, job, submission, jobdir, exitcode, timings):
+        try:
+            result = self._collect(submission, jobdir, exitcode)
+        except JudgeError as e:
+            self.judge.save_error(submission, str(e))
+            self.queue.fail(job, str(e))
+            return
+        self.judge.save(submission, result, timings)
+        self.queue.complete(job)
+        logging.info("judged %s in %s", submission.uid, timings)
+
+    def _run_sharded(self, job, timings):
+        """Large testsuites are split over several containers, this holds a pool thread until they finish."""
+        submission = job.submission
+        try:
+            result = self.judge.run_sharded(submission, timings)
+        except JudgeError as e:
+            self.judge.save_error(submission, str(e))
+            self.queue.fail(job, str(e))
+            return
+        self.judge.save(submission, result, timings)
+        self.queue.complete(job)
+        logging.info("judged %s in %s shards, %s", submission.uid, len(timings.get("shards", [])), timings)
+
+    def _remove(self, container, jobdir):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError:
+            pass
+        shutil.rmtree(jobdir, ignore_errors=True)
+
+    def report(self):
+        """Lists the coordinator among the judge workers, its capacity is the container limit."""
+        JudgeWorker.objects(uid=self.queue.worker).update_one(
+            upsert=True,
+            set__host=socket.gethostname(),
+            set__capacity=self._concurrency,
+            set__running=len(self._jobs),
+            set__sandbox=self.judge.sandbox.stats(),
+            set__started_at=self._started_at,
+            set__heartbeat_at=generate_timestamp()
+        )
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self._lease / 3)
+            try:
+                for uid in await self._blocking(self.queue.heartbeat, list(self._jobs.values())):
+                    logging.warning("lease of job %s expired, it was handed to another worker", uid)
+                await self._blocking(self.queue.requeue_expired, self._max_attempts)
+                await self._blocking(self.report)
+            except Exception:
+                logging.exception("heartbeat failed")
+
+    async def run(self, job):
+        timings = {}
+        container = None
+        self._jobs[job.uid] = job
+        try:
+            if await self._blocking(lambda: self.judge.shard_count(job.submission.testsuite)) > 1:
+                await self._blocking(self._run_sharded, job, timings)
+                return
+            submission, jobdir, container = await self._blocking(self._start, job, timings)
+            # registered before start so an instant exit can't be missed
+            finished = self._loop.create_future()
+            self._pending[container.id] = finished
+            start = time.monotonic()
+            await self._blocking(container.start)
+            try:
+                # the checker is killed by timeout inside the container, this only covers a stuck container
+                exitcode = await asyncio.wait_for(finished, self._timeout + 30)
+            except asyncio.TimeoutError:
+                self._pending.pop(container.id, None)
+                # the die event may have been missed while the stream reconnected
+                state = await self._blocking(self._docker.api.inspect_container, container.id)
+                exitcode = 124 if state["State"]["Running"] else state["State"]["ExitCode"]
+            timings["execute"] = round(time.monotonic() - start, 3)
+            await self._blocking(self._finish, job, submission, jobdir, exitcode, timings)
+        except Exception:
+            error = traceback.format_exc()
+            await self._blocking(lambda: self.judge.save_error(job.submission, "Internal Judge Error"))
+            await self._blocking(self.queue.fail, job, error)
+        finally:
+            self._jobs.pop(job.uid, None)
+            if container is not None:
+                self._pending.pop(container.id, None)
+                await self._blocking(self._remove, container, jobdir)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        await self._blocking(self.report)
+        threading.Thread(target=self._watch, daemon=True).start()
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        slots = asyncio.Semaphore(self._concurrency)
+        try:
+            while True:
+                await slots.acquire()
+                # rejudges and multi testsuite sessions are left to worker.py
+                job = await self._blocking(self.queue.pull, False, mode='full', siblings__0__exists=False)
+                if not job:
+                    slots.release()
+                    await asyncio.sleep(self._poll_interval)
+                    continue
+                task = asyncio.ensure_future(self.run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            heartbeat.cancel()
+            # running jobs are requeued by other workers once their lease runs out
+            JudgeWorker.delete(uid=self.queue.worker)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    coordinator = Coordinator()
+    asyncio.run(coordinator.serve())
@@ -0,0 +1,61 @@
+import uuid
+from pymongo import UpdateOne
+from db.models import Testsuite, Testcase, Submission
+
+def embedded_testcases(batch_size=1000):
+    """Moves testcases still embedded in testsuite documents into the testcases collection."""
+    testsuites = Testsuite._get_collection()
+    testcases = Testcase._get_collection()
+    moved = 0
+    for document in testsuites.find({'testcases': {'$exists': True}}, {'testcases': 1}):
+        # a previous run may have stopped half way, start over for this testsuite
+        testcases.delete_many({'testsuite': document['_id']})
+        batch = []
+        seen = set()
+        for order, testcase in enumerate(document['testcases']):
+            fields = {k: v for k, v in testcase.items() if k in Testcase._fields}
+            # old uids were 5 characters and could repeat, they must be unique within a testsuite now
+            while fields.get('uid') in seen or not fields.get('uid'):
+                fields['uid'] = uuid.uuid4().hex[:10]
+            seen.add(fields['uid'])
+            batch.append(Testcase(testsuite=document['_id'], order=order, **fields).to_mongo())
+            if len(batch) == batch_size:
+                testcases.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            testcases.insert_many(batch, ordered=False)
+        testsuites.update_one(
+            {'_id': document['_id']},
+            {'$unset': {'testcases': 1}, '$set': {'next_order': len(document['testcases'])}}
+        )
+        moved += len(document['testcases'])
+    return moved
+
+def testcase_order():
+    """Starts the order counter of testsuites created without one after their last testcase."""
+    testsuites = Testsuite._get_collection()
+    testcases = Testcase._get_collection()
+    for document in testsuites.find({'next_order': {'$exists': False}}, {'_id': 1}):
+        last = testcases.find_one({'testsuite': document['_id']}, {'order': 1}, sort=[('order', -1)])
+        next_order = last['order'] + 1 if last else 0
+        testsuites.update_one(
+            {'_id': document['_id'], 'next_order': {'$exists': False}},
+            {'$set': {'next_order': next_order}}
+        )
+
+def submission_status(batch_size=1000):
+    """Copies the verdict of submissions judged before they had a status field out of their result."""
+    submissions = Submission._get_collection()
+    updated = 0
+    batch = []
+    for document in submissions.find({'status': {'$exists': False}}, {'result': 1}):
+        result = document.get('result') or {}
+        # judging used to be synchronous, a submission without a verdict never got one
+        status = result.get('summary', {}).get('status') or 'Error'
+        batch.append(UpdateOne({'_id': document['_id'], 'status': {'$exists': False}}, {'$set': {'status': status}}))
+        if len(batch) == batch_size:
+            updated += submissions.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += submissions.bulk_write(batch, ordered=False).modified_count
+    return updated
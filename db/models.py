@@ -1,5 +1,5 @@
 import uuid, time, hashlib, json, types
-from mongoengine import fields, Document, EmbeddedDocument, DoesNotExist, ValidationError
+from mongoengine import fields, Document, DoesNotExist, ValidationError
 
 default_meta = {'allow_inheritance': True, "db_alias": 'hexa-a-db'}
 
@@ -126,15 +126,6 @@ class GroupMembership(BaseModel):
     # db collection
     meta = {"collection":"group_membership"}
 
-class Testcase(EmbeddedDocument):
-    uid = fields.StringField(unique=True, required=True)
-    stdin = fields.StringField(required=True)
-    expected_stdout = fields.StringField(required=True)
-    added_by = fields.StringField(required=True)
-    added_at = fields.IntField(required=True)
-    suggested_by = fields.StringField(default=None)
-    suggested_at = fields.IntField(default=None)
-    
 class Testsuite(BaseModel):
     uid = fields.StringField(required=True, primary_key=True)
     name = fields.StringField(required=True, min_length=3, max_length=50)
@@ -142,8 +133,17 @@ class Testsuite(BaseModel):
     public = fields.BooleanField(default=False)
     enable_suggestions = fields.BooleanField(default=False)
     attempts = fields.IntField(default=0)
+    concurrency = fields.IntField(default=1, min_value=1, max_value=64)
+    time_limit = fields.FloatField(default=3, min_value=0.1, max_value=60)
+    memory_limit = fields.IntField(default=256, min_value=16, max_value=4096)
+    fail_fast = fields.IntField(default=0, min_value=0)
+    compiler_standard = fields.StringField(default='c++17', choices=['c++14', 'c++17', 'c++20'])
+    compiler_optimization = fields.StringField(default='O2', choices=['O0', 'O1', 'O2', 'O3'])
+    # bumped on every change to testcases, attachments or settings
+    revision = fields.IntField(default=0)
+    # order given to the next added testcase, only ever moves forward
+    next_order = fields.IntField(default=0)
     group = fields.ReferenceField(Group, required=True, reverse_delete_rule=2)
-    testcases = fields.EmbeddedDocumentListField(Testcase, default=[])
     created_at = fields.IntField(required=True)
     created_by = fields.ReferenceField(User, required=True)
     updated_at = fields.IntField()
@@ -151,6 +151,75 @@ class Testsuite(BaseModel):
     # db collection
     meta = {"collection":"testsuite"}
 
+    @property
+    def testcases(self):
+        """Testcases in judging order, loaded lazily from their own collection."""
+        return Testcase.objects(testsuite=self.uid).order_by('order')
+
+    def testcase_uids(self):
+        return [testcase['uid'] for testcase in self.testcases.only('uid').as_pymongo()]
+
+    @classmethod
+    def allocate(cls, uid, count):
+        """Reserves count testcase orders in one atomic update.
+
+        The revision is left alone, callers bump it once the testcases are
+        written so no bundle or memo key is built from a revision missing them.
+        """
+        testsuite = cls.objects(uid=uid).modify(inc__next_order=count, new=True)
+        return testsuite.next_order - count if testsuite else None
+
+class Testcase(BaseModel):
+    uid = fields.StringField(required=True)
+    testsuite = fields.ReferenceField(Testsuite, required=True, reverse_delete_rule=2)
+    # position in the testsuite, testcases are judged and listed in this order
+    order = fields.IntField(required=True)
+    stdin = fields.StringField(required=True)
+    expected_stdout = fields.StringField(required=True)
+    added_by = fields.StringField(required=True)
+    added_at = fields.IntField(required=True)
+    suggested_by = fields.StringField(default=None)
+    suggested_at = fields.IntField(default=None)
+    # db collection
+    meta = {
+        "collection":"testcases",
+        "indexes": [('testsuite', 'order'), {'fields': ('testsuite', 'uid'), 'unique': True}]
+    }
+
+    @classmethod
+    def add_all(cls, testsuite, testcases, start=None, batch_size=1000):
+        """Appends testcases given as dicts to the testsuite with bulk inserts.
+
+        Orders are reserved on the testsuite and its revision is bumped after
+        the insert, unless the caller already reserved them from start and
+        bumps the revision itself. Either all testcases are inserted or none.
+        """
+        if not testcases:
+            return 0
+        documents = [cls(testsuite=testsuite, order=0, **testcase) for testcase in testcases]
+        # nothing is inserted unless every testcase is valid
+        for document in documents:
+            document.validate()
+        revise = start is None
+        if revise:
+            start = Testsuite.allocate(testsuite, len(documents))
+        for i, document in enumerate(documents):
+            document.order = start + i
+        try:
+            for i in range(0, len(documents), batch_size):
+                cls.objects.insert(documents[i:i + batch_size], load_bulk=False)
+        except Exception:
+            # earlier batches are already in, the reserved orders are simply skipped
+            cls.objects(testsuite=testsuite, uid__in=[document.uid for document in documents]).delete()
+            raise
+        if revise:
+            Testsuite.objects(uid=testsuite).update(inc__revision=1)
+        return len(documents)
+
+    def to_dict(self):
+        # the testsuite is known to the caller and the object id is internal
+        return {k: self[k] for k in minimal_repr['Testcase'] if self[k] is not None}
+
 class SuggestedTestcase(BaseModel):
     uid = fields.StringField(required=True, primary_key=True)
     user = fields.ReferenceField(User, required=True, reverse_delete_rule=2)
@@ -207,10 +276,73 @@ class Submission(BaseModel):
     username = fields.StringField(required=True)
     submitted_at = fields.IntField(required=True)
     language = fields.StringField(required=True)
-    result = fields.DictField(required=True)
+    status = fields.StringField(default='Pending')
+    result = fields.DictField(default={})
     file_ref = fields.StringField()
+    judge_key = fields.StringField()
+    deterministic = fields.BooleanField(default=False)
+    # seconds spent in each judge stage
+    timings = fields.DictField(default={})
+    # db collection
+    meta = {"collection":"submissions", "indexes": ['judge_key']}
+
+class RejudgeBatch(BaseModel):
+    uid = fields.StringField(required=True, primary_key=True)
+    group = fields.ReferenceField(Group, required=True, reverse_delete_rule=2)
+    # unset for the incremental batches testcase edits schedule across assignments
+    assignment = fields.ReferenceField(Assignment, reverse_delete_rule=2)
+    testsuite = fields.ReferenceField(Testsuite, reverse_delete_rule=2)
+    # scheduling batches get their jobs queued by a worker, not by the request that created them
+    state = fields.StringField(required=True, default='running', choices=['scheduling', 'expanding', 'running', 'done', 'cancelled'])
+    # max jobs of the batch judged at once, live submissions are always served first
+    concurrency = fields.IntField(default=1, min_value=1, max_value=64)
+    total = fields.IntField(default=0)
+    running = fields.IntField(default=0)
+    done = fields.IntField(default=0)
+    failed = fields.IntField(default=0)
+    created_by = fields.StringField(required=True)
+    created_at = fields.IntField(required=True)
+    finished_at = fields.IntField()
+    # db collection
+    meta = {"collection":"rejudge_batches", "indexes": [('state', 'created_at')]}
+
+class JudgeJob(BaseModel):
+    uid = fields.StringField(required=True, primary_key=True)
+    submission = fields.ReferenceField(Submission, required=True, reverse_delete_rule=2)
+    state = fields.StringField(required=True, default='queued', choices=['queued', 'running', 'done', 'failed'])
+    # incremental jobs only judge testcases the stored result doesn't cover
+    mode = fields.StringField(default='full', choices=['full', 'incremental', 'rejudge'])
+    batch = fields.ReferenceField(RejudgeBatch, reverse_delete_rule=2)
+    # same source submitted to other testsuites, judged in the same sandbox session
+    siblings = fields.ListField(fields.ReferenceField(Submission), default=[])
+    attempts = fields.IntField(default=0)
+    error = fields.StringField()
+    # worker holding the job, it has to renew the lease until the job is finished
+    worker = fields.StringField()
+    lease_expires = fields.IntField()
+    created_at = fields.IntField(required=True)
+    started_at = fields.IntField()
+    finished_at = fields.IntField()
+    # db collection
+    meta = {"collection":"judge_queue", "indexes": [('state', 'created_at'), ('batch', 'state'), 'siblings', ('state', 'lease_expires')]}
+
+class JudgeWorker(BaseModel):
+    uid = fields.StringField(required=True, primary_key=True)
+    host = fields.StringField(required=True)
+    # jobs the worker runs at once and how many it is running now
+    capacity = fields.IntField(default=1)
+    running = fields.IntField(default=0)
+    sandbox = fields.DictField(default={})
+    started_at = fields.IntField(required=True)
+    heartbeat_at = fields.IntField(required=True)
+    # db collection
+    meta = {"collection":"judge_workers"}
+
+class Counter(BaseModel):
+    name = fields.StringField(required=True, primary_key=True)
+    value = fields.IntField(default=0)
     # db collection
-    meta = {"collection":"submissions"}
+    meta = {"collection":"counters"}
 
 class GroupJoinRequest(BaseModel):
     uid = fields.StringField(required=True, primary_key=True)
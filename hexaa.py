@@ -38,7 +38,7 @@ class HEXAA:
         # import ipdb; ipdb.set_trace()
         miniocl = Minio(minio_url, minio_key, minio_secret, secure=False)
         self._app.config["miniocl"] = miniocl
-        for bucket in ["pictures", "submissions", "testsuites"]:
+        for bucket in ["pictures", "submissions", "testsuites", "bundles", "results"]:
             if not miniocl.bucket_exists(bucket):
                 miniocl.make_bucket(bucket)
 
@@ -47,6 +47,7 @@ class HEXAA:
         self._app.register_blueprint(users_api, url_prefix='/api')
         self._app.register_blueprint(groups_api, url_prefix='/api')
         self._app.register_blueprint(submission_api, url_prefix='/api')        
+        self._app.register_blueprint(judge_api, url_prefix='/api')
         self._app.register_blueprint(assignments_api, url_prefix='/api/groups/<groupId>')
         self._app.register_blueprint(announcements_api, url_prefix='/api/groups/<groupId>')
         self._app.register_blueprint(testsuites_api, url_prefix='/api/groups/<groupId>')
@@ -0,0 +1,29 @@
+"""Moves testcases embedded in testsuite documents into their own collection,
+and gives submissions judged before the judge queue their status.
+
+Run once after upgrading, before the app serves requests:
+
+    python3 scripts/migrate_testcases.py
+
+Safe to run again, testsuites that were already moved are left alone.
+"""
+import argparse, sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from db.db import Database
+from db import migrations
+from tools.tools import read_config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    Database().connect(**read_config()['database'])
+    moved = migrations.embedded_testcases(args.batch_size)
+    migrations.testcase_order()
+    statuses = migrations.submission_status(args.batch_size)
+    print("moved {} testcases, set the status of {} submissions".format(moved, statuses))
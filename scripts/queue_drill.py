@@ -0,0 +1,104 @@
+"""Runs several judge worker processes against one mongod with a fake judge.
+
+Workers claim, heartbeat and complete jobs through the real queue, some of
+them crash mid job so leases expire and the jobs are picked up again:
+
+    python3 scripts/queue_drill.py --host localhost --workers 4 --jobs 200 --crash 0.05
+
+Everything is written to a separate database (hexa-a-drill by default), which
+is cleared first.
+"""
+import argparse, multiprocessing, os, random, sys, time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from db.db import Database
+from db.models import JudgeJob, JudgeWorker, Submission
+from tools.queue import JudgeQueue
+from tools.tools import generate_uuid, generate_timestamp
+from worker import Worker
+
+
+class DrillWorker(Worker):
+    def __init__(self, crash, **kwargs):
+        self.crash = crash
+        super().__init__(**kwargs)
+
+    def create_judge(self):
+        return None
+
+    def process(self, job):
+        time.sleep(random.uniform(0.05, 0.3))
+        if random.random() < self.crash:
+            # node lost mid job, nothing is written back
+            os._exit(1)
+        Submission.objects(uid=job.submission.uid).update(status='Passed', inc__result__runs=1)
+        self.queue.complete(job)
+
+
+def serve(index, crash, slots, lease, database):
+    DrillWorker(crash, worker_id="drill-{}-{}".format(index, os.getpid()), slots=slots, lease=lease, database=database).serve()
+
+
+def spawn(index, args, database):
+    process = multiprocessing.Process(target=serve, args=(index, args.crash, args.slots, args.lease, database), daemon=True)
+    process.start()
+    return process
+
+
+def setup(jobs):
+    for model in (JudgeJob, JudgeWorker, Submission):
+        model.drop_collection()
+    queue = JudgeQueue()
+    for _ in range(jobs):
+        submission = Submission(uid=generate_uuid(20), status='Pending', submitted_at=generate_timestamp())
+        # bypasses validation, the drill submissions reference no group or testsuite
+        Submission._get_collection().insert_one(submission.to_mongo())
+        queue.push(submission)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--db", default="hexa-a-drill")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--lease", type=int, default=3, help="seconds, short so lost jobs come back quickly")
+    parser.add_argument("--crash", type=float, default=0.05, help="chance a worker dies mid job")
+    parser.add_argument("--timeout", type=int, default=300)
+    args = parser.parse_args()
+
+    database = {"db": args.db, "host": args.host, "port": args.port}
+    Database().connect(**database)
+    setup(args.jobs)
+
+    multiprocessing.set_start_method("spawn")
+    workers = [spawn(i, args, database) for i in range(args.workers)]
+    started = time.monotonic()
+    while time.monotonic() - started < args.timeout:
+        if not JudgeJob.objects(state__in=['queued', 'running']).count():
+            break
+        for i, process in enumerate(workers):
+            if not process.is_alive():
+                # a replacement node joins, the dead one's leases expire on their own
+                workers[i] = spawn(i, args, database)
+        time.sleep(1)
+
+    for process in workers:
+        process.terminate()
+
+    runs = [submission.result.get('runs', 0) for submission in Submission.objects.only('result')]
+    summary = {
+        'jobs': args.jobs,
+        'done': JudgeJob.objects(state='done').count(),
+        'failed': JudgeJob.objects(state='failed').count(),
+        'unfinished': JudgeJob.objects(state__in=['queued', 'running']).count(),
+        'retried': JudgeJob.objects(attempts__gt=1).count(),
+        'judged_twice': len([count for count in runs if count > 1]),
+        'seconds': round(time.monotonic() - started, 1)
+    }
+    print(summary)
+    sys.exit(1 if summary['unfinished'] or summary['judged_twice'] else 0)
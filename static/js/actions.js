@@ -461,6 +461,21 @@ $(document).ready(function () {
         return false;
     });
 
+    $("#submission-status").each(function(){
+        var data = $(this).data();
+        var poll = setInterval(function(){
+            hexaa.groups.assignments.status(data.submission)
+            .then((response)=>{
+                if (response.status != 'Pending' && response.status != 'Running'){
+                    clearInterval(poll);
+                    window.location.reload();
+                }
+            }).catch((error)=>{
+                clearInterval(poll);
+            });
+        }, 2000);
+    });
+
     $("a[name='downloadfile']").click(function(){
         var data = $(this).data();
         hexaa.groups.assignments.downloadFile(data.submission)
@@ -249,6 +249,12 @@ function Assignment(client) {
         let dataType = 'json';
         return this.client.call_api(url, 'get', null, null, dataType);
     }
+    // method for GET /submissions/<submissionId>/status
+    this.status = function(submissionId){
+        let url = '/api/submissions/' + submissionId + '/status';
+        let dataType = 'json';
+        return this.client.call_api(url, 'get', null, null, dataType);
+    }
 }
 
 function Testsuite(client) {
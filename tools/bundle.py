@@ -0,0 +1,139 @@
+import errno, json, os, shutil, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+def write_testcases(testsuite, f):
+    """Streams the testcases into f as JSON lines, never holding the whole suite in memory."""
+    testcases = testsuite.testcases.only('uid', 'stdin', 'expected_stdout').as_pymongo().batch_size(500)
+    for testcase in testcases:
+        data = {'uid': testcase['uid'], 'stdin': testcase['stdin'], 'expected_stdout': testcase['expected_stdout']}
+        f.write(json.dumps(data) + "\n")
+
+class BundleCache:
+    """Node local store of prepared testsuites (testcases file and attachments).
+
+    Bundles are keyed by testsuite id and revision, every edit bumps the revision
+    so stale bundles are never served. Jobs get hardlinks to the read-only files.
+    """
+
+    def __init__(self, root, max_size, minio, download_workers=4):
+        self.root = root
+        self.max_size = max_size
+        self.minio = minio
+        self.download_workers = download_workers
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, testsuite):
+        return os.path.join(self.root, "{}-{}".format(testsuite.uid, testsuite.revision))
+
+    def get(self, testsuite):
+        entry = self._entry(testsuite)
+        if os.path.isdir(entry):
+            self.hits += 1
+            # mark entry as recently used
+            os.utime(entry)
+            return entry
+
+        self.misses += 1
+        tmpdir = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            self._build(testsuite, tmpdir)
+            os.chmod(tmpdir, 0o755)
+            os.rename(tmpdir, entry)
+        except OSError as e:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            # another worker on this node built it first
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+        self._drop_revisions(testsuite)
+        self.evict(keep=entry)
+        return entry
+
+    def _build(self, testsuite, bundledir):
+        testpath = os.path.join(bundledir, "testcases.jsonl")
+        with open(testpath, "w") as f:
+            write_testcases(testsuite, f)
+
+        def download(attachment_name):
+            path = os.path.join(bundledir, attachment_name.split("/")[1])
+            self.minio.fget_object('testsuites', attachment_name, path)
+
+        attachments = self.minio.list_objects("testsuites", prefix="{}/".format(testsuite.uid))
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            # list() re-raises the first failed download
+            list(executor.map(download, [attachment.object_name for attachment in attachments]))
+
+        # linked into every job, submitted code must not be able to change them
+        for name in os.listdir(bundledir):
+            os.chmod(os.path.join(bundledir, name), 0o444)
+
+    def prepare(self, testsuite, userdir, bundle=None):
+        try:
+            self.link(bundle or self.get(testsuite), userdir)
+        except FileNotFoundError:
+            # evicted between lookup and linking, build it again
+            self.link(self.get(testsuite), userdir)
+
+    def link(self, bundle, userdir):
+        for name in os.listdir(bundle):
+            src = os.path.join(bundle, name)
+            dst = os.path.join(userdir, name)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # cache lives on another filesystem
+                shutil.copy2(src, dst)
+
+    def _drop_revisions(self, testsuite):
+        prefix = "{}-".format(testsuite.uid)
+        for name in os.listdir(self.root):
+            revision = name[len(prefix):]
+            if name.startswith(prefix) and revision.isdigit() and int(revision) < testsuite.revision:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def _entry_size(self, entry):
+        size = 0
+        for name in os.listdir(entry):
+            size += os.path.getsize(os.path.join(entry, name))
+        return size
+
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            # skip bundles that are still being built
+            if name.startswith(".tmp-"):
+                continue
+            entry = os.path.join(self.root, name)
+            if entry == keep:
+                continue
+            try:
+                size = self._entry_size(entry)
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+
+        # drop least recently used bundles first, running jobs keep their hardlinks
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0
+        }
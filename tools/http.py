@@ -11,6 +11,9 @@ class HttpResponse:
     def Created(self, msg=None):
         return self.sendResponse(status=201, msg=msg)
 
+    def Accepted(self, msg=None):
+        return self.sendResponse(status=202, msg=msg, content_type='application/json')
+
     def NoContent(self, msg=None):
         return self.sendResponse(status=204, msg=msg)
 
@@ -0,0 +1,439 @@
+import io, json, math, os, shutil, tarfile, tempfile, time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from db.models import Submission
+from tools.sandbox import Sandbox
+from tools.bundle import BundleCache, write_testcases
+from tools.memo import is_deterministic
+from tools.rejudge import summarize
+from tools.tools import read_config
+from minio import Minio, error
+from pymongo.errors import DocumentTooLarge
+
+config = read_config('config.yaml')
+tmp_code_dir = config['dirs']['tmp_code_dir']
+judgeconf = config['judge']
+minioconf = config["minio"]
+
+minio_key = os.environ.get("MINIO_ACCESS_KEY") or minioconf["key"]
+minio_secret = os.environ.get("MINIO_SECRET_KEY") or  minioconf["secret"]
+miniocl = Minio(minioconf["url"], minio_key, minio_secret, secure=False)
+
+# uids of the testcases a partial run judges, one per line, next to testcases.jsonl
+ONLY_FILE = "only.txt"
+
+class JudgeError(Exception):
+    pass
+
+def partial_result(lines, uids, message):
+    """Result of a killed run rebuilt from the checker's result.jsonl."""
+    compiler = {}
+    finished = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # the last line may have been cut off mid write
+            continue
+        kind = record.pop("type", None)
+        if kind == "compiler":
+            compiler = record
+        elif kind == "test":
+            finished[record["uid"]] = record
+
+    # keep the testsuite order, testcases that never ran are reported as skipped
+    tests = [finished.get(uid, {"uid": uid, "status": "skipped"}) for uid in uids]
+    summary = summarize(tests)
+    summary.update(
+        status="Timeout",
+        partial=True,
+        message="{} after {} of {} testcases".format(message, len(finished), len(tests))
+    )
+    return {"compiler": compiler, "tests": tests, "summary": summary}
+
+def merge_shards(testsuite, compiler, results):
+    """One result document out of the shard results, in testsuite order."""
+    judged = {}
+    for result in results:
+        for test in result.get("tests", []):
+            judged[test["uid"]] = test
+    # a testcase no shard reported on was never judged, it can't pass silently
+    missing = {"status": "errored", "message": "No shard reported this testcase"}
+    tests = [judged.get(uid, dict(missing, uid=uid)) for uid in testsuite.testcase_uids()]
+    summary = summarize(tests)
+
+    # a shard that timed out makes the whole result partial
+    for result in results:
+        shard = result.get("summary", {})
+        if shard.get("partial"):
+            summary.update(status=shard["status"], partial=True, message=shard.get("message"))
+    return {"compiler": compiler, "tests": tests, "summary": summary}
+
+class Judge:
+    def __init__(self, pool_size=None):
+        self.transfer = judgeconf['transfer']
+        self._published = set()
+        self.sandbox = Sandbox(
+            image=judgeconf['image'],
+            workroot=tmp_code_dir,
+            pool_size=judgeconf['pool_size'] if pool_size is None else pool_size,
+            max_uses=judgeconf['max_uses'],
+            cache_dir=judgeconf['compile_cache'],
+            limits=judgeconf['container_limits'],
+            mount=self.transfer == 'mount',
+            network=judgeconf['storage_network'] if self.transfer == 'presigned' else None,
+            tmpfs=judgeconf['tmpfs_size'] if self.transfer == 'archive' else None
+        )
+        if judgeconf['compile_cache']:
+            os.makedirs(judgeconf['compile_cache'], exist_ok=True)
+        self.bundles = BundleCache(
+            judgeconf['bundle_cache'],
+            judgeconf['bundle_cache_size'],
+            miniocl,
+            download_workers=judgeconf['stage_workers']
+        )
+        self.stager = ThreadPoolExecutor(max_workers=judgeconf['stage_workers'])
+        self.sandbox.warmup()
+
+    def _timed(self, timings, stage, func, *args):
+        start = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            timings[stage] = round(time.monotonic() - start, 3)
+
+    def _fetch_source(self, submission, stagedir):
+        sourcepath = os.path.join(stagedir, os.path.basename(submission.file_ref))
+        miniocl.fget_object('submissions', submission.file_ref, sourcepath)
+        return sourcepath
+
+    def _acquire(self, timings, worker):
+        return worker or self._timed(timings, "acquire", self.sandbox.acquire)
+
+    def _prepare(self, submission, timings, worker=None, subdir=""):
+        """Acquires a sandbox while the bundle and source are fetched in the background."""
+        # staged next to the job dirs so the source can be renamed into place
+        stagedir = tempfile.mkdtemp(prefix="stage-", dir=tmp_code_dir)
+        bundle = self.stager.submit(self._timed, timings, "bundle", self.bundles.get, submission.testsuite)
+        source = self.stager.submit(self._timed, timings, "source", self._fetch_source, submission, stagedir)
+        acquired = None
+        try:
+            acquired = self._acquire(timings, worker)
+            start = time.monotonic()
+            userdir = os.path.join(acquired.path, subdir)
+            os.makedirs(userdir, exist_ok=True)
+            self.bundles.prepare(submission.testsuite, userdir, bundle.result())
+            sourcepath = source.result()
+            sourcefile = os.path.basename(sourcepath)
+            os.rename(sourcepath, os.path.join(userdir, sourcefile))
+            timings["link"] = round(time.monotonic() - start, 3)
+            return acquired, sourcefile
+        except Exception:
+            if acquired and not worker:
+                self.sandbox.release(acquired)
+            raise
+        finally:
+            # a failed acquire mustn't leave a download writing into the removed dir
+            wait([bundle, source])
+            shutil.rmtree(stagedir, ignore_errors=True)
+
+    def _publish_testcases(self, testsuite):
+        object_name = "{}/{}/testcases.jsonl".format(testsuite.uid, testsuite.revision)
+        if object_name not in self._published:
+            with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+                write_testcases(testsuite, f)
+                f.flush()
+                miniocl.fput_object("bundles", object_name, f.name)
+            self._published.add(object_name)
+        return object_name
+
+    def _manifest(self, submission):
+        testsuite = submission.testsuite
+        expires = timedelta(seconds=judgeconf['timeout'] + 60)
+        testcases = self._publish_testcases(testsuite)
+        files = [{"name": "testcases.jsonl", "url": miniocl.presigned_get_object("bundles", testcases, expires)}]
+
+        attachments = miniocl.list_objects("testsuites", prefix="{}/".format(testsuite.uid))
+        for attachment in attachments:
+            attachment_name = attachment.object_name
+            url = miniocl.presigned_get_object("testsuites", attachment_name, expires)
+            files.append({"name": attachment_name.split("/")[1], "url": url})
+
+        url = miniocl.presigned_get_object("submissions", submission.file_ref, expires)
+        files.append({"name": os.path.basename(submission.file_ref), "url": url})
+        return {
+            "files": files,
+            "result": miniocl.presigned_put_object("results", "{}.json".format(submission.uid), expires)
+        }
+
+    def _prepare_remote(self, submission, timings, worker=None):
+        """Signs the job files while a sandbox is acquired, the checker downloads them itself."""
+        manifest = self.stager.submit(self._timed, timings, "manifest", self._manifest, submission)
+        acquired = self._acquire(timings, worker)
+        try:
+            return acquired, os.path.basename(submission.file_ref), manifest.result()
+        except Exception:
+            if not worker:
+                self.sandbox.release(acquired)
+            raise
+
+    def read_source(self, submission):
+        response = miniocl.get_object("submissions", submission.file_ref)
+        return response.read()
+
+    def _archive(self, bundle, sourcefile, source, subdir=""):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as tar:
+            if subdir:
+                info = tarfile.TarInfo(subdir)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            for name in os.listdir(bundle):
+                tar.add(os.path.join(bundle, name), arcname=os.path.join(subdir, name))
+            info = tarfile.TarInfo(os.path.join(subdir, sourcefile))
+            info.size = len(source)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(source))
+        return data.getvalue()
+
+    def _prepare_archive(self, submission, timings, worker=None, subdir=""):
+        """Ships the job files into the sandbox tmpfs as a tar stream, nothing is written on the host."""
+        bundle = self.stager.submit(self._timed, timings, "bundle", self.bundles.get, submission.testsuite)
+        source = self.stager.submit(self._timed, timings, "source", self.read_source, submission)
+        acquired = self._acquire(timings, worker)
+        try:
+            start = time.monotonic()
+            sourcefile = os.path.basename(submission.file_ref)
+            try:
+                archive = self._archive(bundle.result(), sourcefile, source.result(), subdir)
+            except FileNotFoundError:
+                # evicted before it was read, build it again
+                archive = self._archive(self.bundles.get(submission.testsuite), sourcefile, source.result(), subdir)
+            if not acquired.put_archive(archive):
+                raise JudgeError("Can't upload job files")
+            timings["upload"] = round(time.monotonic() - start, 3)
+            return acquired, sourcefile
+        except Exception:
+            if not worker:
+                self.sandbox.release(acquired)
+            raise
+        finally:
+            wait([bundle, source])
+
+    def _collect(self, submission, worker, subdir=""):
+        if self.transfer == 'archive':
+            data = worker.get_file(os.path.join("/data", subdir, "result.json"))
+            if data is None:
+                raise JudgeError("Can't fetch test result")
+            return json.loads(data.decode("utf-8"))
+
+        if self.transfer == 'presigned':
+            object_name = "{}.json".format(submission.uid)
+            try:
+                response = miniocl.get_object("results", object_name)
+                result = json.loads(response.read().decode("utf-8"))
+            except error.NoSuchKey:
+                raise JudgeError("Can't fetch test result")
+            miniocl.remove_object("results", object_name)
+            return result
+
+        resultpath = os.path.join(worker.path, subdir, "result.json")
+        if not os.path.isfile(resultpath):
+            raise JudgeError("Can't fetch test result")
+
+        with open(resultpath, "r") as f:
+            return json.load(f)
+
+    def _read_stream(self, worker, subdir=""):
+        if self.transfer == 'archive':
+            data = worker.get_file(os.path.join("/data", subdir, "result.jsonl"))
+            return data.decode("utf-8").splitlines() if data else []
+        if self.transfer == 'presigned':
+            # the checker only uploads its final result
+            return []
+
+        streampath = os.path.join(worker.path, subdir, "result.jsonl")
+        if not os.path.isfile(streampath):
+            return []
+        with open(streampath, "r") as f:
+            return f.read().splitlines()
+
+    def _partial(self, submission, worker, message, only=None, subdir=""):
+        lines = self._read_stream(worker, subdir)
+        if not lines:
+            raise JudgeError(message)
+        uids = submission.testsuite.testcase_uids()
+        if only:
+            only = set(only)
+            uids = [uid for uid in uids if uid in only]
+        return partial_result(lines, uids, message)
+
+    def _write_only(self, worker, only, subdir=""):
+        """Puts the uid list in the job dir, thousands of uids don't fit in an environment variable."""
+        data = "".join(uid + "\n" for uid in only).encode("utf-8")
+        if self.transfer == 'mount':
+            with open(os.path.join(worker.path, subdir, ONLY_FILE), "wb") as f:
+                f.write(data)
+            return
+
+        # /data only exists once the checker fetched a presigned job, the tar creates it
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            dirs = ["data"] + ([os.path.join("data", subdir)] if subdir else [])
+            for name in dirs:
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            info = tarfile.TarInfo(os.path.join(dirs[-1], ONLY_FILE))
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+        if not worker.put_archive(archive.getvalue(), "/"):
+            raise JudgeError("Can't upload job files")
+
+    def environment(self, submission, sourcefile, only=None, subdir="", compile_only=False, manifest=None):
+        """Checker settings of a judge run."""
+        envars = {
+            "PRO_LANGUAGE": submission.language,
+            "SOURCE_FILE": sourcefile,
+            "TEST_FILE": "testcases.jsonl",
+            "CONCURRENCY": str(submission.testsuite.concurrency),
+            "TIME_LIMIT": str(submission.testsuite.time_limit),
+            "MEMORY_LIMIT": str(submission.testsuite.memory_limit << 20),
+            "FAIL_FAST": str(submission.testsuite.fail_fast),
+            "COMPILER_STD": submission.testsuite.compiler_standard,
+            "COMPILER_OPT": submission.testsuite.compiler_optimization,
+            "RUN_AS": "nobody",
+            "OUTPUT_LIMIT": str(judgeconf['output_limit'])
+        }
+        if judgeconf['compile_cache']:
+            envars["COMPILE_CACHE"] = "/cache"
+            envars["COMPILE_CACHE_SIZE"] = str(judgeconf['compile_cache_size'])
+        if manifest:
+            envars["JOB_MANIFEST"] = json.dumps(manifest)
+        if only:
+            envars["ONLY_FILE"] = ONLY_FILE
+        if compile_only:
+            envars["COMPILE_ONLY"] = "1"
+        if subdir:
+            envars["WORK_DIR"] = os.path.join("/data", subdir)
+            if not judgeconf['compile_cache']:
+                # later testsuites of the session reuse the first compile
+                envars["COMPILE_CACHE"] = "/data/.compile"
+                envars["COMPILE_CACHE_SIZE"] = str(judgeconf['compile_cache_size'])
+        return envars
+
+    def stage(self, submission, timings):
+        """Job dir holding the bundle and source, for a container started outside the pool."""
+        jobdir = tempfile.mkdtemp(prefix="job-", dir=tmp_code_dir)
+        try:
+            os.chmod(jobdir, 0o755)
+            bundle = self.stager.submit(self._timed, timings, "bundle", self.bundles.get, submission.testsuite)
+            sourcepath = self._timed(timings, "source", self._fetch_source, submission, jobdir)
+            self.bundles.prepare(submission.testsuite, jobdir, bundle.result())
+            return jobdir, os.path.basename(sourcepath)
+        except Exception:
+            shutil.rmtree(jobdir, ignore_errors=True)
+            raise
+
+    def run(self, submission, timings=None, only=None, worker=None, subdir="", compile_only=False):
+        """Judges a submission, in a fresh sandbox unless a worker of a running session is given."""
+        timings = {} if timings is None else timings
+        session = worker
+        start = time.monotonic()
+        manifest = None
+        if self.transfer == 'presigned':
+            worker, sourcefile, manifest = self._prepare_remote(submission, timings, session)
+        elif self.transfer == 'archive':
+            worker, sourcefile = self._prepare_archive(submission, timings, session, subdir)
+        else:
+            worker, sourcefile = self._prepare(submission, timings, session, subdir)
+        try:
+            if only:
+                self._write_only(worker, only, subdir)
+            timings["staging"] = round(time.monotonic() - start, 3)
+            envars = self.environment(submission, sourcefile, only, subdir, compile_only, manifest)
+            exitcode = self._timed(timings, "execute", worker.execute, envars, judgeconf['timeout'])
+            if exitcode == 124:
+                return self._partial(submission, worker, "Judge timed out", only, subdir)
+            return self._timed(timings, "collect", self._collect, submission, worker, subdir)
+        finally:
+            if not session:
+                self.sandbox.release(worker)
+
+    def shard_count(self, testsuite):
+        # shards share the compile through the node compile cache, fail fast needs one ordered run
+        if not judgeconf['compile_cache'] or testsuite.fail_fast:
+            return 1
+        shards = math.ceil(testsuite.testcases.count() / judgeconf['shard_size'])
+        return max(1, min(judgeconf['max_shards'], shards))
+
+    def run_sharded(self, submission, timings=None):
+        """Compiles once, then judges round robin slices of the testcases in parallel sandboxes."""
+        timings = {} if timings is None else timings
+        testsuite = submission.testsuite
+        count = self.shard_count(testsuite)
+        if count < 2:
+            return self.run(submission, timings)
+
+        compiled = self.run(submission, timings, compile_only=True)
+        if compiled.get("summary", {}).get("status") != "Compiled":
+            return compiled
+
+        uids = testsuite.testcase_uids()
+        shards = [uids[i::count] for i in range(count)]
+        shard_timings = [{} for _ in shards]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [
+                executor.submit(self.run, submission, shard_timings[i], shard)
+                for i, shard in enumerate(shards)
+            ]
+            # list() re-raises the first failed shard
+            results = [future.result() for future in futures]
+        timings["shards"] = shard_timings
+        timings["execute"] = round(time.monotonic() - start, 3)
+        return merge_shards(testsuite, compiled["compiler"], results)
+
+    def run_many(self, submissions):
+        """Judges submissions of one source against several testsuites in a single sandbox session.
+
+        Returns (result or JudgeError, timings) per submission uid, the source is
+        compiled once and later testsuites hit the compile cache.
+        """
+        timings = {}
+        worker = self._timed(timings, "acquire", self.sandbox.acquire)
+        results = {}
+        try:
+            for submission in submissions:
+                subtimings = dict(timings)
+                try:
+                    result = self.run(submission, subtimings, worker=worker, subdir=submission.uid)
+                except JudgeError as e:
+                    result = e
+                results[submission.uid] = (result, subtimings)
+            return results
+        finally:
+            self.sandbox.release(worker)
+
+    def save(self, submission, result, timings=None, judge_key=None):
+        status = result.get("summary", {}).get("status", "Error")
+        update = {"judge_key": judge_key} if judge_key else {}
+        try:
+            Submission.objects(uid=submission.uid).update(
+                result=result,
+                status=status,
+                deterministic=is_deterministic(result),
+                timings=timings or {},
+                **update
+            )
+        except DocumentTooLarge:
+            self.save_error(submission, "Can't return your result because it is too large, please make sure your code doesn't print huge amount of data in stdout")
+
+    def save_error(self, submission, error):
+        result = {"summary": {"status": "Error"}, "error": error}
+        Submission.objects(uid=submission.uid).update(result=result, status="Error")
@@ -0,0 +1,47 @@
+import hashlib, json
+from db.models import Submission, Counter
+
+deterministic_status = ['Passed', 'Failed', 'Compiler Error']
+
+def is_deterministic(result):
+    summary = result.get('summary', {})
+    if summary.get('status') not in deterministic_status:
+        return False
+
+    # time and memory verdicts depend on host load, so they can't be replayed
+    for test in result.get('tests', []):
+        if test.get('verdict') in ['TLE', 'MLE']:
+            return False
+    return True
+
+class ResultMemo:
+    """Reuses judge results of identical (source, testsuite) pairs."""
+
+    def key(self, testsuite, filename, language, source):
+        digest = hashlib.sha256()
+        limits = [testsuite.time_limit, testsuite.memory_limit, testsuite.fail_fast]
+        profile = [testsuite.compiler_standard, testsuite.compiler_optimization]
+        # the revision changes with every edit to testcases and attachments
+        bundle = [testsuite.uid, testsuite.revision]
+        digest.update(json.dumps([filename, language, limits, profile, bundle]).encode('utf-8'))
+        digest.update(hashlib.sha256(source).digest())
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        submission = Submission.objects(judge_key=key, deterministic=True).first()
+        self._count('memo_hits' if submission else 'memo_misses')
+        return submission
+
+    def _count(self, name):
+        Counter.objects(name=name).update_one(inc__value=1, upsert=True)
+
+    def stats(self):
+        counters = {c.name: c.value for c in Counter.objects(name__in=['memo_hits', 'memo_misses'])}
+        hits = counters.get('memo_hits', 0)
+        misses = counters.get('memo_misses', 0)
+        requests = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / requests if requests else 0
+        }
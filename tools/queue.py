@@ -0,0 +1,132 @@
+from db.models import JudgeJob, Submission, RejudgeBatch
+from tools.tools import generate_uuid, generate_timestamp
+
+class JudgeQueue:
+    """Durable submission queue stored in the judge_queue collection.
+
+    A worker pulling with an id holds a lease on each job it claims. Jobs whose
+    lease isn't renewed in time are handed back to the queue by requeue_expired.
+    """
+
+    def __init__(self, worker=None, lease=60):
+        self.worker = worker
+        self.lease = lease
+
+    def push(self, submission, mode='full', batch=None, siblings=None):
+        job = JudgeJob(
+            uid=generate_uuid(20),
+            submission=submission,
+            siblings=siblings or [],
+            state='queued',
+            mode=mode,
+            batch=batch,
+            created_at=generate_timestamp()
+        )
+        job.save()
+        return job
+
+    def _lease(self):
+        if not self.worker:
+            return {}
+        return {'worker': self.worker, 'lease_expires': generate_timestamp() + self.lease}
+
+    def _claim(self, **filters):
+        # findAndModify guarantees a job is handed to a single worker
+        return JudgeJob.objects(state='queued', **filters).order_by('created_at').modify(
+            state='running',
+            started_at=generate_timestamp(),
+            inc__attempts=1,
+            new=True,
+            **self._lease()
+        )
+
+    def _claim_batch(self):
+        for batch in RejudgeBatch.objects(state='running').order_by('created_at'):
+            # reserve a slot first so concurrent workers can't exceed the batch concurrency
+            reserved = RejudgeBatch.objects(uid=batch.uid, state='running', running__lt=batch.concurrency).modify(
+                inc__running=1,
+                new=True
+            )
+            if not reserved:
+                continue
+            job = self._claim(batch=batch.uid)
+            if job:
+                return job
+            RejudgeBatch.objects(uid=batch.uid).update(dec__running=1)
+        return None
+
+    def pull(self, batches=True, **filters):
+        # live submissions go before rejudge batches
+        job = self._claim(batch=None, **filters) or (self._claim_batch() if batches else None)
+        # rejudged submissions keep showing their current result until the new one is saved
+        if job and job.mode == 'full':
+            uids = [job.submission.uid] + [sibling.uid for sibling in job.siblings]
+            Submission.objects(uid__in=uids).update(status='Running')
+        return job
+
+    def _count(self, job, field):
+        if not job.batch:
+            return
+        batch = RejudgeBatch.objects(uid=job.batch.uid).modify(dec__running=1, **{'inc__' + field: 1}, new=True)
+        if batch and batch.state == 'running' and batch.done + batch.failed >= batch.total:
+            RejudgeBatch.objects(uid=batch.uid, state='running').update(state='done', finished_at=generate_timestamp())
+
+    def _finish(self, job, **update):
+        # a job requeued after its lease expired belongs to another worker now
+        owner = {'worker': self.worker} if self.worker else {}
+        return JudgeJob.objects(uid=job.uid, state='running', **owner).update(
+            finished_at=generate_timestamp(),
+            **update
+        )
+
+    def complete(self, job):
+        if self._finish(job, state='done'):
+            self._count(job, 'done')
+
+    def fail(self, job, error):
+        if self._finish(job, state='failed', error=error):
+            self._count(job, 'failed')
+
+    def heartbeat(self, jobs):
+        """Renews the lease of running jobs, returns the uids of jobs this worker lost."""
+        lost = []
+        for job in jobs:
+            renewed = JudgeJob.objects(uid=job.uid, state='running', worker=self.worker).update(
+                lease_expires=generate_timestamp() + self.lease
+            )
+            if not renewed:
+                lost.append(job.uid)
+        return lost
+
+    def requeue_expired(self, max_attempts=3):
+        """Hands jobs of workers that stopped renewing their lease back to the queue."""
+        now = generate_timestamp()
+        count = 0
+        # raw documents, the referenced submissions are only needed by id
+        for job in JudgeJob.objects(state='running', lease_expires__lt=now).as_pymongo():
+            expired = {'uid': job['_id'], 'state': 'running', 'lease_expires__lt': now}
+            uids = [job['submission']] + job.get('siblings', [])
+            if job.get('attempts', 0) >= max_attempts:
+                # a job that keeps killing workers mustn't take the whole fleet down
+                if JudgeJob.objects(**expired).update(state='failed', error='Judge worker lost', finished_at=now):
+                    Submission.objects(uid__in=uids, status='Running').update(
+                        status='Error',
+                        result={'summary': {'status': 'Error'}, 'error': 'Internal Judge Error'}
+                    )
+                    self._count(JudgeJob.objects(uid=job['_id']).first(), 'failed')
+                continue
+
+            if not JudgeJob.objects(**expired).update(state='queued', unset__worker=True, unset__lease_expires=True):
+                continue
+            count += 1
+            if job.get('batch'):
+                # the batch slot is reserved again when the job is claimed
+                RejudgeBatch.objects(uid=job['batch']).update(dec__running=1)
+            if job.get('mode', 'full') == 'full':
+                Submission.objects(uid__in=uids, status='Running').update(status='Pending')
+        return count
+
+    def position(self, job):
+        if job.state != 'queued':
+            return 0
+        return JudgeJob.objects(state='queued', created_at__lte=job.created_at).count()
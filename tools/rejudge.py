@@ -0,0 +1,192 @@
+import os
+from db.models import JudgeJob, Submission, RejudgeBatch
+from tools.queue import JudgeQueue
+from tools.memo import ResultMemo
+from tools.tools import generate_uuid, generate_timestamp, read_config
+from checker.checker.judger import aggregate_usage
+
+config = read_config()
+
+# only complete results can be patched, anything else needs a full judge run
+rejudgeable_status = ['Passed', 'Failed']
+
+def diff(testsuite, result):
+    """Testcases a stored result has no verdict for and result entries whose testcase is gone."""
+    current = testsuite.testcase_uids()
+    stored = {test['uid'] for test in result.get('tests', [])}
+    # skipped tests never ran, they need a verdict as much as new ones
+    judged = {test['uid'] for test in result.get('tests', []) if test['status'] != 'skipped'}
+    added = [uid for uid in current if uid not in judged]
+    removed = stored - set(current)
+    return added, removed
+
+def summarize(tests):
+    """Summary of a result assembled on the server, the counts and usage the checker reports."""
+    count = lambda status: len([test for test in tests if test['status'] == status])
+    failed = count('failed') + count('errored')
+    status = 'Passed'
+    if failed:
+        status = 'Failed'
+    elif count('skipped'):
+        # tests that never ran can't count as passed
+        status = 'Incomplete'
+    return {
+        'success': count('passed'),
+        'failures': count('failed'),
+        'errors': count('errored'),
+        'skipped': count('skipped'),
+        'status': status,
+        'usage': aggregate_usage(tests)
+    }
+
+def merge(testsuite, result, tests):
+    """Stored result patched with freshly judged tests, in testsuite order."""
+    judged = {test['uid']: test for test in result.get('tests', [])}
+    judged.update({test['uid']: test for test in tests})
+    merged = [judged[uid] for uid in testsuite.testcase_uids() if uid in judged]
+    return dict(result, tests=merged, summary=summarize(merged))
+
+def schedule(testsuite, username):
+    """Schedules an incremental rejudge of the testsuite submissions after its testcases changed.
+
+    Only the batch is created here, a worker queues its jobs with expand_scheduled
+    and they run throttled behind live submissions like any rejudge batch.
+    """
+    # a batch that isn't expanded yet will see this edit too
+    if RejudgeBatch.objects(testsuite=testsuite.uid, state='scheduling').first():
+        return None
+    batch = RejudgeBatch(
+        uid=generate_uuid(20),
+        group=testsuite.group,
+        testsuite=testsuite.uid,
+        concurrency=config['judge']['rejudge_concurrency'],
+        state='scheduling',
+        created_by=username,
+        created_at=generate_timestamp()
+    )
+    batch.save()
+    return batch
+
+def expand_scheduled():
+    """Queues the incremental jobs of batches scheduled by testcase edits."""
+    queue = JudgeQueue()
+    count = 0
+    while True:
+        # findAndModify hands each batch to a single worker
+        batch = RejudgeBatch.objects(state='scheduling').order_by('created_at').modify(state='expanding', new=True)
+        if not batch:
+            return count
+
+        # a queued rejudge diffs against the testsuite when it runs, one per submission is enough
+        queued = {
+            job['submission'] for job in
+            JudgeJob.objects(state='queued', mode='incremental').only('submission').as_pymongo()
+        }
+        submissions = Submission.objects(testsuite=batch.testsuite.uid, status__in=rejudgeable_status).only('uid')
+        total = 0
+        for submission in submissions:
+            if submission.uid in queued:
+                continue
+            queue.push(submission, mode='incremental', batch=batch)
+            total += 1
+
+        # jobs of an expanding batch aren't claimed, total is final before any of them runs
+        finished = {} if total else {'finished_at': generate_timestamp()}
+        RejudgeBatch.objects(uid=batch.uid).update(total=total, state='running' if total else 'done', **finished)
+        count += total
+
+def schedule_batch(groupId, assignmentId, username, testsuiteId=None, concurrency=1):
+    """Queues a full rejudge of the assignment submissions, throttled to concurrency jobs at once."""
+    filters = {'assignment': assignmentId}
+    if testsuiteId:
+        filters['testsuite'] = testsuiteId
+    # pending submissions are judged against the current testsuite anyway
+    submissions = list(Submission.objects(status__nin=['Pending', 'Running'], **filters).only('uid'))
+
+    # total is known before the first job can finish so the batch isn't closed early
+    batch = RejudgeBatch(
+        uid=generate_uuid(20),
+        group=groupId,
+        assignment=assignmentId,
+        testsuite=testsuiteId,
+        concurrency=concurrency,
+        total=len(submissions),
+        state='running' if submissions else 'done',
+        created_by=username,
+        created_at=generate_timestamp()
+    )
+    err = batch.check()
+    if err:
+        return None, err
+    batch.save()
+
+    queue = JudgeQueue()
+    for submission in submissions:
+        queue.push(submission, mode='rejudge', batch=batch)
+    return batch, None
+
+def cancel_batch(batch):
+    queued = JudgeJob.objects(batch=batch.uid, state='queued').update(
+        state='failed',
+        error='Rejudge cancelled',
+        finished_at=generate_timestamp()
+    )
+    RejudgeBatch.objects(uid=batch.uid, state='running').update(
+        state='cancelled',
+        inc__failed=queued,
+        finished_at=generate_timestamp()
+    )
+
+def progress(batch):
+    finished = batch.done + batch.failed
+    elapsed = (batch.finished_at or generate_timestamp()) - batch.created_at
+    eta = None
+    if batch.state == 'running' and finished:
+        # seconds left at the rate observed so far
+        eta = round(elapsed / finished * (batch.total - finished))
+    return {
+        'uid': batch.uid,
+        'state': batch.state,
+        'concurrency': batch.concurrency,
+        'total': batch.total,
+        'done': batch.done,
+        'failed': batch.failed,
+        'running': batch.running,
+        'pending': max(0, batch.total - finished - batch.running),
+        'elapsed': elapsed,
+        'eta': eta
+    }
+
+def rejudge(judge, submission, timings=None):
+    """Runs only the testcases a stored result is missing and drops the removed ones."""
+    testsuite = submission.testsuite
+    result = submission.result
+    added, removed = diff(testsuite, result)
+    if not (added or removed):
+        return result
+
+    tests = []
+    # failures of removed testcases no longer count towards fail fast
+    failed = [
+        test for test in result.get('tests', [])
+        if test['uid'] not in removed and test['status'] in ('failed', 'errored')
+    ]
+    exhausted = testsuite.fail_fast and len(failed) >= testsuite.fail_fast
+    if added and exhausted:
+        # fail fast already stopped this submission, new testcases wouldn't run either
+        tests = [{'uid': uid, 'status': 'skipped'} for uid in added]
+    elif added:
+        # the compile cache turns the rebuild of an unchanged source into a lookup
+        new = judge.run(submission, timings, only=added)
+        if new.get('summary', {}).get('status') not in rejudgeable_status:
+            # e.g. a timeout, patching would mix verdicts of different runs
+            return judge.run_sharded(submission, timings)
+        tests = new['tests']
+
+    return merge(testsuite, result, tests)
+
+def judge_key(judge, submission):
+    """Memo key of the submission against the current testsuite revision."""
+    source = judge.read_source(submission)
+    filename = os.path.basename(submission.file_ref)
+    return ResultMemo().key(submission.testsuite, filename, submission.language, source)
@@ -1,26 +1,217 @@
 import docker
-import os
+import io, os, shutil, tarfile, threading, time
+from collections import deque
+from tools.tools import generate_uuid
+
+class SandboxWorker:
+    """Pre-started checker container that executes judge jobs on demand."""
+
+    def __init__(self, container, path):
+        self.container = container
+        self.path = path
+        self.uses = 0
+        self._baseline_processes = len(container.top()["Processes"])
+        self._baseline_changes = self._changes()
+
+    def _changes(self):
+        changes = set()
+        for change in self.container.diff() or []:
+            path = change["Path"]
+            if path.startswith(("/data", "/tmp")) or "__pycache__" in path:
+                continue
+            changes.add(path)
+        return changes
+
+    def execute(self, env=None, timeout=60):
+        self.uses += 1
+        cmd = ["timeout", str(timeout), "python3", "checker.py"]
+        response = self.container.exec_run(cmd, environment=env)
+        return response.exit_code
+
+    def put_archive(self, data, path="/data"):
+        return self.container.put_archive(path, data)
+
+    def get_file(self, path):
+        """Reads a single file out of the container, None when it doesn't exist."""
+        try:
+            stream, _ = self.container.get_archive(path)
+        except docker.errors.NotFound:
+            return None
+        with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+            return tar.extractfile(tar.next()).read()
+
+    def clean(self):
+        # tests run as nobody and can write to the world writable dirs, the next job must not see it
+        scratch = ["/tmp", "/dev/shm"]
+        if not self.path:
+            # job files only live inside the container, /data may be a tmpfs mountpoint
+            scratch.append("/data")
+        self.container.exec_run(["find"] + scratch + ["-mindepth", "1", "-delete"])
+        if not self.path:
+            return
+        for name in os.listdir(self.path):
+            filepath = os.path.join(self.path, name)
+            if os.path.isdir(filepath) and not os.path.islink(filepath):
+                shutil.rmtree(filepath)
+            else:
+                os.remove(filepath)
+
+    def is_tampered(self):
+        try:
+            self.container.reload()
+            if self.container.status != "running":
+                return True
+            # leftover processes or filesystem changes outside the job dirs
+            if len(self.container.top()["Processes"]) != self._baseline_processes:
+                return True
+            return self._changes() != self._baseline_changes
+        except docker.errors.APIError:
+            return True
+
+    def destroy(self):
+        try:
+            self.container.remove(force=True)
+        except docker.errors.APIError:
+            pass
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
 
 class Sandbox:
-    def __init__(self):
+    def __init__(self, image="checker", workroot="/tmp", pool_size=0, max_uses=1, cache_dir=None, limits=None,
+                 mount=True, network=None, tmpfs=None):
         self._docker = docker.from_env()
+        self.image = image
+        self.workroot = workroot
+        # without a mount the checker fetches job files over network
+        self.mount = mount
+        self.network = network
+        # size of an in memory /data, job files are then shipped as tar streams
+        self.tmpfs = tmpfs
+        self.cache_dir = cache_dir
+        self.limits = limits or {}
+        self.pool_size = pool_size
+        self.max_uses = max_uses
+        self._pool = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._stats = {"hits": 0, "misses": 0, "created": 0, "recycled": 0}
+        self._latencies = deque(maxlen=100)
+
+    def _tmpfs(self):
+        # /tmp is a tmpfs so it never shows up as a filesystem change and is cheap to wipe
+        tmpfs = {"/tmp": "rw,exec,mode=1777"}
+        if self.tmpfs:
+            tmpfs["/data"] = "rw,exec,mode=755,size={}".format(self.tmpfs)
+        return tmpfs
 
-    def create(self, image, path, env=None):
-        mounts = [{
-            'Source': os.path.join(path),
-            'Target': "/data",
-            'Type': 'bind',
-            'ReadOnly': False
-        }]
+    def create(self, image, path, env=None, command=None, labels=None):
+        mounts = []
+        if path:
+            mounts.append({
+                'Source': os.path.join(path),
+                'Target': "/data",
+                'Type': 'bind',
+                'ReadOnly': False
+            })
+        if self.cache_dir:
+            mounts.append({
+                'Source': self.cache_dir,
+                'Target': "/cache",
+                'Type': 'bind',
+                'ReadOnly': False
+            })
         container = self._docker.containers.create(
-            image=image, 
+            image=image,
+            command=command,
             mounts=mounts,
             environment=env,
-            network_disabled=True,
-            tty=True
+            labels=labels,
+            network=self.network,
+            network_disabled=not self.network,
+            tmpfs=self._tmpfs(),
+            tty=True,
+            mem_limit=self.limits.get('memory'),
+            memswap_limit=self.limits.get('memory'),
+            nano_cpus=int(self.limits.get('cpus', 0) * 1e9) or None,
+            pids_limit=self.limits.get('pids')
         )
         return container
 
+    def _spawn(self):
+        started = time.time()
+        path = None
+        if self.mount:
+            path = os.path.join(self.workroot, "sandbox-" + generate_uuid(20))
+            os.mkdir(path)
+        container = self.create(self.image, path, command=["sleep", "infinity"])
+        container.start()
+        worker = SandboxWorker(container, path)
+        with self._lock:
+            self._stats["created"] += 1
+            self._latencies.append(time.time() - started)
+        return worker
+
+    def _refill(self):
+        try:
+            while len(self._pool) < self.pool_size:
+                worker = self._spawn()
+                with self._lock:
+                    self._pool.append(worker)
+        finally:
+            self._refilling = False
+
+    def warmup(self):
+        with self._lock:
+            if self._refilling or len(self._pool) >= self.pool_size:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def acquire(self):
+        with self._lock:
+            worker = self._pool.popleft() if self._pool else None
+            self._stats["hits" if worker else "misses"] += 1
+
+        if not worker:
+            worker = self._spawn()
+        return worker
+
+    def release(self, worker):
+        worker.clean()
+        recycle = worker.uses >= self.max_uses or worker.is_tampered()
+        with self._lock:
+            if recycle or len(self._pool) >= self.pool_size:
+                self._stats["recycled"] += 1
+                recycle = True
+            else:
+                self._pool.append(worker)
+
+        if recycle:
+            worker.destroy()
+            self.warmup()
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._pool = list(self._pool), deque()
+        for worker in workers:
+            worker.destroy()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+            stats["pool"] = len(self._pool)
+
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / requests if requests else 0
+        if latencies:
+            stats["create_latency"] = {
+                "p50": latencies[len(latencies) // 2],
+                "max": latencies[-1]
+            }
+        return stats
+
     def start(self, cid):
         self._docker.api.start(cid)
 
@@ -28,4 +219,4 @@ class Sandbox:
         self._docker.api.remove_container(cid, force=True)
 
     def wait(self, timeout=60):
-        self._docker.wait(timeout=timeout)
\ No newline at end of file
+        self._docker.wait(timeout=timeout)
@@ -1,10 +1,11 @@
 from os import path, mkdir, getcwd, fstat
+from itertools import islice
 from datetime import datetime
 from flask import Markup
 import uuid, time, hashlib, json, yaml, mistune
 from subprocess import run, PIPE, TimeoutExpired
 from email.mime.text import MIMEText
-import smtplib, math
+import smtplib, math, io, zipfile
 
 def generate_uuid(length=10):
     return str(uuid.uuid4()).replace('-', '')[:length]
@@ -61,28 +62,80 @@ def timestamp_to_age(target):
         return 'Just now'
 
 
-def parse_testcases_file(file, username, timestamp):
+def _iter_pairs(stream):
+    """stdin and expected stdout on alternating lines, newlines escaped."""
     def escape_line(line):
-        return line.replace("\\n", "\n").replace("\\t", "\t").replace("\\r", "\r")
-
-    content = file.read().decode('utf-8')
-    lines = content.splitlines()
-    if len(lines) % 2 != 0:
-        return None
-
+        return line.rstrip("\r\n").replace("\\n", "\n").replace("\\t", "\t").replace("\\r", "\r")
+
+    lines = io.TextIOWrapper(stream, encoding='utf-8')
+    for number, pair in enumerate(iter(lambda: list(islice(lines, 2)), []), start=1):
+        if len(pair) != 2:
+            raise ValueError('line {}: testcase has no expected output'.format(number * 2 - 1))
+        yield escape_line(pair[0]), escape_line(pair[1])
+
+def _iter_jsonl(stream):
+    """One {"stdin": ..., "expected_stdout": ...} object per line."""
+    for number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), start=1):
+        if not line.strip():
+            continue
+        try:
+            testcase = json.loads(line)
+            yield str(testcase['stdin']), str(testcase['expected_stdout'])
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('line {}: expected an object with stdin and expected_stdout'.format(number))
+
+def _iter_zip(stream):
+    """NN.in and NN.out pairs, ordered by name."""
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise ValueError('invalid zip archive')
+
+    with archive:
+        members = {}
+        for name in archive.namelist():
+            stem, extension = path.splitext(name)
+            if extension in ('.in', '.out'):
+                members.setdefault(stem, {})[extension] = name
+
+        for stem in sorted(members):
+            pair = members[stem]
+            if len(pair) != 2:
+                raise ValueError('{}: missing {} file'.format(stem, '.out' if '.in' in pair else '.in'))
+            try:
+                stdin = archive.read(pair['.in']).decode('utf-8')
+                stdout = archive.read(pair['.out']).decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValueError('{}: not utf-8 text'.format(stem))
+            yield stdin, stdout
+
+def iter_testcases(file, filename=''):
+    """Streams (stdin, expected_stdout) pairs out of an uploaded testcases file.
+
+    The format follows the extension: .jsonl, .zip of NN.in/NN.out pairs, or
+    the plain two lines per testcase format. Raises ValueError on malformed input.
+    """
+    extension = get_file_extension(filename or '').lower()
+    if extension == '.jsonl':
+        return _iter_jsonl(file)
+    if extension == '.zip':
+        return _iter_zip(file)
+    return _iter_pairs(file)
+
+def parse_testcases_file(file, username, timestamp, filename=''):
     testcases = []
-    for i in range(int(len(lines)/2)):
-        stdin = escape_line(lines.pop(0))
-        stdout = escape_line(lines.pop(0))
-        testcase = {
-            'uid': generate_uuid(5),
-            'stdin': stdin,
-            'expected_stdout': stdout,
-            'added_by': username,
-            'added_at': timestamp
-        }
-        testcases.append(testcase)
-
+    try:
+        for stdin, stdout in iter_testcases(file, filename):
+            testcases.append({
+                # large suites would collide on short uids
+                'uid': generate_uuid(10),
+                'stdin': stdin,
+                'expected_stdout': stdout,
+                'added_by': username,
+                'added_at': timestamp
+            })
+    except UnicodeDecodeError:
+        raise ValueError('testcases file is not utf-8 text')
     return testcases
 
 def datetimeToEpoc(value):
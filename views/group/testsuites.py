@@ -31,7 +31,9 @@ def TestsuitePage(** kwargs):
     groupId = kwargs.get('groupId')
     testsuiteId = kwargs.get('testsuiteId')
     group = api.groups.get(groupId=groupId).json()
-    testsuite = api.groups.testsuites.get(groupId, testsuiteId).json()
+    limit = request.args.get('limit', 25, int)
+    page_ = request.args.get('page', 1, int)
+    testsuite = api.groups.testsuites.get(groupId, testsuiteId, params={'limit':limit, 'page':page_}).json()
 
     if subtab not in ['testcases', 'suggestions', 'settings']:
         subtab = 'testcases'
@@ -0,0 +1,165 @@
+import argparse, os, signal, socket, sys, threading, time, traceback, logging
+from db.db import Database
+from db.models import JudgeWorker
+from tools.tools import read_config, generate_timestamp
+from tools.queue import JudgeQueue
+from tools.judge import Judge, JudgeError
+from tools import rejudge
+
+class Worker:
+    """Judge node, any number of them can pull from the same queue.
+
+    Claimed jobs are leased to the worker id, a heartbeat thread renews the
+    leases, requeues jobs of workers that went silent and reports capacity.
+    """
+
+    def __init__(self, worker_id=None, slots=None, lease=None, database=None):
+        self._config = read_config()
+        judgeconf = self._config['judge']
+        self._poll_interval = judgeconf['poll_interval']
+        self._lease = lease or judgeconf['lease']
+        self._max_attempts = judgeconf['max_attempts']
+        self.id = worker_id or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.slots = slots or judgeconf['worker_slots']
+        # connect to database
+        self._db = Database()
+        self._db.connect(** (database or self._config['database']))
+        self.queue = JudgeQueue(worker=self.id, lease=self._lease)
+        self.judge = self.create_judge()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._started_at = generate_timestamp()
+
+    def create_judge(self):
+        return Judge()
+
+    def process_rejudge(self, job):
+        submission = job.submission
+        timings = {}
+        try:
+            if job.mode == 'incremental':
+                result = rejudge.rejudge(self.judge, submission, timings)
+            else:
+                result = self.judge.run_sharded(submission, timings)
+            judge_key = rejudge.judge_key(self.judge, submission)
+        except Exception as e:
+            # the stored result stays as it was, a new one replaces it in a single update
+            self.queue.fail(job, str(e) if isinstance(e, JudgeError) else traceback.format_exc())
+            return
+
+        self.judge.save(submission, result, timings, judge_key)
+        self.queue.complete(job)
+        logging.info("rejudged %s in %s", submission.uid, timings)
+
+    def process_many(self, job):
+        submissions = [job.submission] + job.siblings
+        try:
+            results = self.judge.run_many(submissions)
+        except Exception:
+            for submission in submissions:
+                self.judge.save_error(submission, "Internal Judge Error")
+            self.queue.fail(job, traceback.format_exc())
+            return
+
+        for submission in submissions:
+            result, timings = results[submission.uid]
+            if isinstance(result, JudgeError):
+                self.judge.save_error(submission, str(result))
+            else:
+                self.judge.save(submission, result, timings)
+        self.queue.complete(job)
+        logging.info("judged %s in one session, sandbox %s", [s.uid for s in submissions], self.judge.sandbox.stats())
+
+    def process(self, job):
+        if job.mode != 'full':
+            return self.process_rejudge(job)
+        if job.siblings:
+            return self.process_many(job)
+
+        submission = job.submission
+        timings = {}
+        try:
+            result = self.judge.run_sharded(submission, timings)
+        except JudgeError as e:
+            self.judge.save_error(submission, str(e))
+            self.queue.fail(job, str(e))
+            return
+        except Exception:
+            self.judge.save_error(submission, "Internal Judge Error")
+            self.queue.fail(job, traceback.format_exc())
+            return
+
+        self.judge.save(submission, result, timings)
+        self.queue.complete(job)
+        logging.info("judged %s in %s, sandbox %s, bundles %s", submission.uid, timings, self.judge.sandbox.stats(), self.judge.bundles.stats())
+
+    def report(self):
+        with self._lock:
+            running = len(self._active)
+        JudgeWorker.objects(uid=self.id).update_one(
+            upsert=True,
+            set__host=socket.gethostname(),
+            set__capacity=self.slots,
+            set__running=running,
+            set__sandbox=self.judge.sandbox.stats() if self.judge else {},
+            set__started_at=self._started_at,
+            set__heartbeat_at=generate_timestamp()
+        )
+
+    def _heartbeat(self):
+        # a few beats per lease so a slow round trip doesn't lose the jobs
+        while True:
+            time.sleep(self._lease / 3)
+            try:
+                with self._lock:
+                    jobs = list(self._active.values())
+                for uid in self.queue.heartbeat(jobs):
+                    logging.warning("lease of job %s expired, it was handed to another worker", uid)
+                requeued = self.queue.requeue_expired(self._max_attempts)
+                if requeued:
+                    logging.info("requeued %s jobs of lost workers", requeued)
+                scheduled = rejudge.expand_scheduled()
+                if scheduled:
+                    logging.info("queued %s incremental rejudges", scheduled)
+                self.report()
+            except Exception:
+                logging.exception("heartbeat failed")
+
+    def _serve_slot(self):
+        while True:
+            job = self.queue.pull()
+            if not job:
+                time.sleep(self._poll_interval)
+                continue
+            with self._lock:
+                self._active[job.uid] = job
+            try:
+                self.process(job)
+            finally:
+                with self._lock:
+                    self._active.pop(job.uid, None)
+
+    def serve(self):
+        self.report()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        slots = [threading.Thread(target=self._serve_slot, daemon=True) for _ in range(self.slots)]
+        for slot in slots:
+            slot.start()
+        try:
+            for slot in slots:
+                slot.join()
+        finally:
+            # running jobs are requeued by other workers once their lease runs out
+            JudgeWorker.delete(uid=self.id)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="judge worker, run one per judge node")
+    parser.add_argument("--id", type=str, default=os.environ.get("JUDGE_WORKER_ID"), help="worker id, defaults to host-pid")
+    parser.add_argument("--slots", type=int, default=os.environ.get("JUDGE_WORKER_SLOTS"), help="jobs judged at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # docker stop sends SIGTERM, unwind so the worker deregisters
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    worker = Worker(worker_id=args.id, slots=args.slots)
+    worker.serve()